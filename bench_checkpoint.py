@@ -0,0 +1,90 @@
+"""
+チェックポイントからのスケジューラ復元の確認 (ネットワーク・DB 不要)
+
+使い方:
+  python bench_checkpoint.py            # 12場 × 12R の1日分
+  python bench_checkpoint.py 24 5       # 24場 / 5サイクル目の途中で停止
+
+締切順に1日を進め、指定したサイクルで due() の直後 (完了・再予約の前) にチェックポイントを保存して止める。
+復元 → 開催情報の再登録 (main.load_schedule と同じ add) の後、残りの全レースが
+ちょうど1回ずつ取得時刻を迎えることを確認し、保存・復元の時間とファイルサイズを表示します。
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import checkpoint
+from scheduler import RaceScheduler
+
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+STEP = datetime.timedelta(minutes=1)
+
+def day_schedule(venues, start):
+    """会場ごとに10:30から30分おき・会場ごとに2分ずらした12レース"""
+    return {(jcd, rno): start + datetime.timedelta(minutes=30 * (rno - 1) + 2 * jcd)
+            for jcd in range(1, venues + 1) for rno in range(1, 13)}
+
+def run(scheduler, now, end, seen):
+    """due() で取り出したレースは全て予測済みにして、end まで時計を進める"""
+    while now < end:
+        for key in scheduler.due(now):
+            seen.append(key)
+            scheduler.complete(*key)
+        now += STEP
+    return now
+
+def main():
+    venues = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    stop_cycle = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    start = datetime.datetime(2026, 1, 28, 10, 30, tzinfo=JST)
+    races = day_schedule(venues, start)
+    end = max(races.values()) + STEP
+
+    scheduler = RaceScheduler()
+    for (jcd, rno), deadline in races.items():
+        scheduler.add(jcd, rno, deadline)
+
+    # stop_cycle 回目の取得でレースを取り出した直後に止める (SIGTERM が scan_cycle 中に届いた状態)
+    now = start - scheduler.window
+    seen, cycles, interrupted = [], 0, []
+    while now < end:
+        targets = scheduler.due(now)
+        if targets:
+            cycles += 1
+            if cycles == stop_cycle:
+                interrupted = targets
+                break
+            for key in targets:
+                seen.append(key)
+                scheduler.complete(*key)
+        now += STEP
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bot_state.ckpt")
+        t0 = time.perf_counter()
+        size = checkpoint.save({'scheduler': scheduler.snapshot()}, path)
+        t_save = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        restored = RaceScheduler.restore(checkpoint.load(path)['scheduler'])
+        t_load = time.perf_counter() - t0
+
+    # 次のセッションも開催情報を登録し直す (既に知っているレースは add で増えない)
+    for (jcd, rno), deadline in races.items():
+        restored.add(jcd, rno, deadline)
+    run(restored, now, end, seen)
+
+    missing = sorted(set(races) - set(seen))
+    duplicated = len(seen) - len(set(seen))
+    print("=" * 50)
+    print(f"💾 {len(races)}レース / {cycles}サイクル目で停止 (取得中 {len(interrupted)}レース)")
+    print(f"   保存: {t_save * 1000:.1f}ms / 復元: {t_load * 1000:.1f}ms / {size / 1024:.1f}KB")
+    print(f"   取得時刻を迎えたレース: {len(set(seen))}/{len(races)} (重複 {duplicated})")
+    if missing or duplicated:
+        print(f"❌ 復元後に取得されないレース: {missing[:10]}")
+        sys.exit(1)
+    print("✅ 停止時に取得中だったレースも含め、全レースが復元後に取得されました")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Discord 通知キューのスループット確認 (ローカルのスタブ Webhook サーバーに送る)
+
+使い方:
+  python bench_notifier.py            # 30件を一気に積んで計測
+  python bench_notifier.py 200 3      # 200件 / 1件あたり3行の通知 (短いとまとめ送信で数投稿に収まる)
+
+スタブは Discord と同じく「2秒あたり5投稿」のバケットを持ち、超えると 429 と retry_after を返す。
+同じ Webhook に投稿する別クライアントが、こちらに Remaining 1 を返した直後に最後の1枠を使うので、
+受け取った X-RateLimit-Remaining が古くなって 429 が起き、再送の経路を通る。
+全メッセージが欠けずに届いたこと、投稿数、429 の回数、送り切るまでの時間を表示します。
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import notifier
+
+BUCKET_SIZE = 5
+BUCKET_RESET = 2.0
+NOISE = True            # こちらに Remaining 1 を返した直後、別クライアントが残りの1枠を使う
+
+class StubWebhook(ThreadingHTTPServer):
+    """Discord Webhook のレート制限を真似るだけのサーバー"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.posts = []
+        self.rejected = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/webhook"
+
+    def take(self, count=True):
+        """(受け付けたか, 残り, リセットまでの秒数)"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= BUCKET_RESET:
+                self.window_start, self.used = now, 0
+            reset_after = BUCKET_RESET - (now - self.window_start)
+            if self.used >= BUCKET_SIZE:
+                if count: self.rejected += 1
+                return False, 0, reset_after
+            self.used += 1
+            return True, BUCKET_SIZE - self.used, reset_after
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        ok, remaining, reset_after = self.server.take()
+        if ok:
+            with self.server.lock: self.server.posts.append(body.get("content", ""))
+            self._reply(204, b"", remaining, reset_after)
+            # 同じバケットを使う別クライアントの投稿 (こちらに返した Remaining より実際の残りが減る)
+            if NOISE and remaining == 1:
+                self.server.take(count=False)
+        else:
+            self._reply(429, json.dumps({"message": "You are being rate limited.", "retry_after": round(reset_after, 3)}).encode(), 0, reset_after)
+
+    def _reply(self, code, payload, remaining, reset_after):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-RateLimit-Limit", str(BUCKET_SIZE))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset-After", f"{reset_after:.3f}")
+        if code == 429: self.send_header("Retry-After", f"{reset_after:.3f}")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    # 既定は AI解説付きの長い通知 (1件 1000 文字超 → まとめられず1件1投稿になり、バケットを使い切る)
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    server = StubWebhook()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    messages = [f"🔥 **テスト{k}R** AI激熱予想\n" + "\n".join(f"行{j}: {'x' * 30}" for j in range(lines - 1)) for k in range(n)]
+    t0 = time.perf_counter()
+    notifier.start_notifier(server.url)
+    for msg in messages:
+        notifier.send(msg)
+    t_enqueue = time.perf_counter() - t0
+    notifier.stop_notifier(timeout=300)
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+
+    received = [m for post in server.posts for m in post.split(notifier.SEPARATOR)]
+    print("=" * 50)
+    print(f"📨 {n}件 → {len(server.posts)}投稿 / 429 {server.rejected}回")
+    print(f"   欠落なし: {'OK' if received == messages else 'NG'} / 429 からの再送: {'確認' if server.rejected else '未発生'}")
+    print(f"   積み込み: {t_enqueue * 1000:.1f}ms / 送り切るまで: {elapsed:.2f}秒 ({n / elapsed:.1f}件/秒)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+scraper のHTML抽出ベンチマーク (BeautifulSoup 実装 vs lxml XPath 実装)
+
+使い方:
+  python bench_parser.py              # 合成ページで計測
+  python bench_parser.py <dir> [N]    # <dir>/beforeinfo.html, racelist.html, raceresult.html で計測
+
+両実装の row dict が完全一致することを確認してから、パース+抽出の時間を比較します。
+"""
+import os
+import sys
+import time
+
+from scraper import parse_html, parse_race_pages
+
+def _filler(n):
+    # 実ページのナビ・広告部分の代わり
+    return "".join(f'<div class="nav"><ul><li><a href="/p/{k}">メニュー{k}</a></li><li>お知らせ {k}</li></ul></div>' for k in range(n))
+
+def synthetic_pages():
+    deadline_cells = "".join(f"<td>{10 + r // 2:02d}:{(r % 2) * 30:02d}</td>" for r in range(1, 13))
+    deadline_row = f'<table class="table1"><tbody><tr><th>締切予定時刻</th>{deadline_cells}</tr></tbody></table>'
+
+    before_rows = "".join(
+        f'<tbody class="is-fs12"><tr><td class="is-boatColor{i} is-fs14" rowspan="4">{i}</td>'
+        f'<td rowspan="4"><a href="#">選手{i}</a></td><td rowspan="2">52.0kg</td><td rowspan="4">6.{70 + i}</td>'
+        f'<td rowspan="4">6.{60 + i}</td><td rowspan="4">0.0</td></tr><tr><td>R</td></tr></tbody>'
+        for i in range(1, 7))
+    before = (f'<html><head><meta charset="utf-8"><title>直前情報</title></head><body>{_filler(300)}'
+              f'<div class="weather1"><span class="weather1_bodyUnitLabelTitle">風速</span>'
+              f'<span class="weather1_bodyUnitLabelData">3m</span></div>'
+              f'<table class="is-w748"><thead><tr><th>枠</th></tr></thead>{before_rows}</table></body></html>')
+
+    list_rows = "".join(
+        f'<tbody class="is-fs12"><tr><td class="is-boatColor{i} is-fs14" rowspan="4">{i}</td>'
+        f'<td rowspan="4"><div>4{i}01 / A1</div></td><td rowspan="4">東京/東京</td>'
+        f'<td rowspan="4">F{i % 2}<br>L0<br>0.1{i}</td><td rowspan="4">{i}.{20 + i}<br>36.00<br>55.00</td>'
+        f'<td rowspan="4">6.00<br>40.00<br>60.00</td><td rowspan="4">{10 + i}<br>{30 + i}.50<br>50.00</td></tr>'
+        f'<tr><td>1</td></tr></tbody>'
+        for i in range(1, 7))
+    racelist = (f'<html><head><meta charset="utf-8"><title>出走表</title></head><body>{_filler(400)}'
+                f'{deadline_row}<table class="is-w1012">{list_rows}</table></body></html>')
+
+    rank_rows = "".join(f'<tbody><tr><td>{k}</td><td><span class="is-fs14">{b}</span></td><td>選手</td></tr></tbody>'
+                        for k, b in zip(range(1, 7), [3, 1, 4, 2, 6, 5]))
+    pay_rows = "".join(f'<tbody><tr><td>{name}</td><td>3-1</td><td><span class="is-payout1">¥{pay:,}</span></td></tr></tbody>'
+                       for name, pay in [("3連単", 12340), ("3連複", 2340), ("2連単", 1560), ("単勝", 480)])
+    result = (f'<html><head><meta charset="utf-8"><title>結果</title></head><body>{_filler(300)}'
+              f'<table class="is-w495"><thead><tr><th>着</th></tr></thead>{rank_rows}</table>'
+              f'<table class="is-w495">{pay_rows}</table></body></html>')
+    return before.encode(), racelist.encode(), result.encode()
+
+def load_pages(path):
+    pages = []
+    for name in ("beforeinfo", "racelist", "raceresult"):
+        with open(os.path.join(path, f"{name}.html"), "rb") as f:
+            pages.append(f.read())
+    return tuple(pages)
+
+def run(backend, pages, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        docs = [parse_html(p, backend) for p in pages]
+        row, _ = parse_race_pages(24, 10, "20260101", *docs)
+    return row, (time.perf_counter() - t0) / n * 1000
+
+def main():
+    pages = load_pages(sys.argv[1]) if len(sys.argv) > 1 else synthetic_pages()
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    row_bs4, ms_bs4 = run("bs4", pages, n)
+    row_lxml, ms_lxml = run("lxml", pages, n)
+
+    same = row_bs4 == row_lxml and list(row_bs4) == list(row_lxml)
+    print(f"行データ一致: {'OK' if same else 'NG'}")
+    if not same:
+        for k in row_bs4:
+            if row_bs4.get(k) != row_lxml.get(k):
+                print(f"  {k}: bs4={row_bs4.get(k)!r} lxml={row_lxml.get(k)!r}")
+    print(f"bs4 : {ms_bs4:8.2f} ms/レース")
+    print(f"lxml: {ms_lxml:8.2f} ms/レース (x{ms_bs4 / ms_lxml:.1f})")
+
+if __name__ == "__main__":
+    main()
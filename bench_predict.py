@@ -0,0 +1,69 @@
+"""
+1レース推論のベンチマーク (一括経路 predict_races([row]) vs 高速経路 predict_race)
+
+使い方:
+  python bench_predict.py          # ultimate_boat_model.pkl があればそれを、無ければ合成モデルで計測
+  python bench_predict.py 2000     # 計測回数
+
+両経路の3連単・2連単確率が一致することを確認してから、1レースあたりの時間を比較します。
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+import predict_boat
+
+def synthetic_models():
+    """モデルファイルが無い環境用の小さな LightGBM モデル (本番と同じ特徴量の並び)"""
+    import lightgbm as lgb
+    from train_model import FEATURES
+
+    rng = np.random.default_rng(0)
+    X = rng.random((3000, len(FEATURES))).astype(np.float32)
+    models = {'features': FEATURES}
+    for k, target in enumerate(('r1', 'r2', 'r3')):
+        y = (np.argsort(-X[:, 3:9], axis=1)[:, k] + rng.integers(0, 2, len(X))) % 6
+        models[target] = lgb.train({'objective': 'multiclass', 'num_class': 6, 'verbose': -1, 'num_leaves': 31},
+                                   lgb.Dataset(X, label=y), num_boost_round=100)
+    return models
+
+def sample_row(rnd):
+    row = {'jcd': rnd.randint(1, 24), 'rno': rnd.randint(1, 12), 'wind': rnd.random() * 6, 'date': "20260101"}
+    for i in range(1, 7):
+        row.update({f'wr{i}': round(rnd.uniform(3, 8), 2), f'mo{i}': round(rnd.uniform(20, 60), 2),
+                    f'ex{i}': round(rnd.uniform(6.6, 6.9), 2), f'st{i}': round(rnd.uniform(0.05, 0.25), 2), f'f{i}': 0})
+    return row
+
+def run(fn, rows):
+    t0 = time.perf_counter()
+    for row in rows:
+        fn(row)
+    return (time.perf_counter() - t0) / len(rows) * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if predict_boat.get_models() is None:
+        print("⚠️ モデルファイルなし: 合成モデルで計測します")
+        predict_boat._model_state.update({'models': synthetic_models(), 'checked_at': time.time() + 10 ** 9})
+
+    rnd = random.Random(0)
+    rows = [sample_row(rnd) for _ in range(n)]
+
+    # 確率の一致確認 (float32 の特徴量・同じ Booster なので誤差は丸め程度)
+    diff = 0.0
+    for row in rows[:100]:
+        a = predict_boat.predict_combo_probs([row])
+        b = predict_boat.single_combo_probs(row)
+        diff = max(diff, float(np.abs(a[0] - b[0]).max()), float(np.abs(a[1] - b[1]).max()))
+    print(f"確率一致: {'OK' if diff < 1e-6 else 'NG'} (最大差 {diff:.2e})")
+
+    # 戦略テーブルの照合と表示は両経路共通なので、推論部分だけを比べる
+    batch_us = run(lambda r: predict_boat.predict_combo_probs([r]), rows)
+    fast_us = run(predict_boat.single_combo_probs, rows)
+    print(f"一括経路 (1行): {batch_us:8.1f} µs/レース")
+    print(f"高速経路      : {fast_us:8.1f} µs/レース (x{batch_us / fast_us:.1f})")
+
+if __name__ == "__main__":
+    main()
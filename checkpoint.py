@@ -0,0 +1,41 @@
+"""
+Bot の実行状態を1ファイルに保存し、次の起動 (GitHub Actions の次のセッション) で復元する
+
+保存するもの: スケジューラ (取得予定・予測済みレース)、確定済みレース結果、AI解説キャッシュ。
+買い目・結果待ちは race_data.db の history に入っているので、ここには持たない。
+"""
+import gzip
+import os
+import pickle
+import time
+
+CHECKPOINT_FILE = os.environ.get("BOT_CHECKPOINT", "bot_state.ckpt")
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INTERVAL = 300   # 実行中もこの秒数ごとに保存 (強制終了されても直近の状態が残る)
+
+def save(state, path=None):
+    path = path or CHECKPOINT_FILE
+    payload = {'version': CHECKPOINT_VERSION, 'saved_at': time.time(), 'state': state}
+    tmp = path + ".tmp"
+    try:
+        with gzip.open(tmp, "wb", compresslevel=5) as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+    except Exception as e:
+        print(f"⚠️ チェックポイント保存失敗: {e}", flush=True)
+        return 0
+
+def load(path=None):
+    """保存された state を返す。無い・壊れている・版が違う場合は None"""
+    path = path or CHECKPOINT_FILE
+    try:
+        with gzip.open(path, "rb") as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ チェックポイント読込失敗: {e}", flush=True)
+        return None
+    if payload.get('version') != CHECKPOINT_VERSION: return None
+    return payload['state']
@@ -0,0 +1,145 @@
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# ==========================================
+# ⚙️ 書き込みスレッド設定
+# ==========================================
+FLUSH_INTERVAL = 1.0    # この秒数ごとにまとめてコミット
+FLUSH_COUNT = 200       # これだけ溜まったら間隔を待たずにコミット
+QUEUE_SIZE = 10000
+
+def connect(db_file):
+    """WALモードの接続を返す (読み取り側はこれを使えば書き込み中もブロックされない)"""
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class DBWriter(threading.Thread):
+    """SQLiteへの書き込みを1本のスレッドに集約し、件数・時間でまとめてコミットする"""
+
+    def __init__(self, db_file):
+        super().__init__(name="db-writer", daemon=True)
+        self.db_file = db_file
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.commits = 0
+        self.writes = 0
+
+    def submit(self, sql, params=()):
+        self._queue.put(('one', sql, params))
+
+    def submit_many(self, sql, seq):
+        seq = list(seq)
+        if seq: self._queue.put(('many', sql, seq))
+
+    def flush(self, timeout=30):
+        """ここまでに投入した書き込みがコミット (または破棄) されるまで待つ。時間内に終われば True"""
+        done = threading.Event()
+        self._queue.put(('flush', done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=30):
+        self._queue.put(('stop', None, None))
+        self.join(timeout)
+
+    def run(self):
+        conn = connect(self.db_file)
+        batch = []
+        waiters = []
+        last_commit = time.monotonic()
+        stopping = False
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                kind, a, b = item
+                if kind == 'flush': waiters.append(a)
+                elif kind == 'stop': stopping = True
+                else: batch.append(item)
+
+            due = time.monotonic() - last_commit >= FLUSH_INTERVAL
+            if batch and (due or len(batch) >= FLUSH_COUNT or waiters or stopping):
+                self._commit(conn, batch)
+                batch = []
+                last_commit = time.monotonic()
+            for w in waiters: w.set()
+            waiters = []
+
+            if stopping and self._queue.empty():
+                break
+
+        try:
+            # git にコミットされるのは本体ファイルだけなので、WALを書き戻しておく
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            print(f"⚠️ WALチェックポイント失敗: {e}", flush=True)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        t0 = time.perf_counter()
+        try:
+            with conn:
+                for kind, sql, params in batch:
+                    if kind == 'many': conn.executemany(sql, params)
+                    else: conn.execute(sql, params)
+            self.commits += 1
+            self.writes += len(batch)
+            metrics.observe('db_commit', time.perf_counter() - t0)
+        except Exception as e:
+            # まとめて失敗した場合は1件ずつやり直し、壊れた1件だけを捨てる
+            print(f"⚠️ DB一括書き込み失敗 ({len(batch)}件): {e}", flush=True)
+            for kind, sql, params in batch:
+                try:
+                    with conn:
+                        if kind == 'many': conn.executemany(sql, params)
+                        else: conn.execute(sql, params)
+                except Exception as e2:
+                    print(f"💀 DB書き込み破棄: {e2}", flush=True)
+
+# ==========================================
+# プロセス内で共有する書き込みスレッド
+# ==========================================
+_writer = None
+
+def start_writer(db_file):
+    global _writer
+    if _writer is None:
+        _writer = DBWriter(db_file)
+        _writer.start()
+    return _writer
+
+def stop_writer():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        print(f"💾 DB書き込み完了: {_writer.writes}件 / {_writer.commits}コミット", flush=True)
+        _writer = None
+
+def write(db_file, sql, params=()):
+    """書き込みスレッドがあれば投入して即戻る。無ければ (スクリプト実行時など) その場で書く"""
+    if _writer is not None:
+        _writer.submit(sql, params)
+        return
+    conn = connect(db_file)
+    with conn: conn.execute(sql, params)
+    conn.close()
+
+def write_many(db_file, sql, seq):
+    if _writer is not None:
+        _writer.submit_many(sql, seq)
+        return
+    conn = connect(db_file)
+    with conn: conn.executemany(sql, list(seq))
+    conn.close()
+
+def flush():
+    """書き込みスレッドの分を処理し終えたら True (スレッドが無ければ書き込みは同期なので常に True)"""
+    if _writer is None: return True
+    return _writer.flush()
@@ -0,0 +1,216 @@
+"""
+Groq による買い目解説を予測・通知の外で作るバックグラウンドサービス
+
+予測スレッドは request_reason() で依頼を積んですぐ戻る。解説はワーカースレッドが
+トークンバケットでレート制限しながら生成し、届いたら callback(text) で呼び出し元へ渡す。
+同じ (レース, 買い目, 特徴量ハッシュ) の解説はキャッシュから返し、Groq を二度呼ばない。
+"""
+import collections
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import metrics
+
+# ==========================================
+# ⚙️ Groq設定
+# ==========================================
+GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+GROQ_RPM = float(os.environ.get("GROQ_RPM", "30"))   # 1分あたりの上限リクエスト数
+GROQ_BURST = 3          # 連続して即時に投げてよい数
+GROQ_TIMEOUT = 10
+MAX_ATTEMPTS = 3
+WORKERS = 2
+QUEUE_SIZE = 200        # 溢れた依頼は捨てる (解説は無くても買い目の通知は済んでいる)
+CACHE_MAX = 1000
+
+NO_KEY_REASON = "AI解説: (APIキー設定なし)"
+
+class TokenBucket:
+    """rate 個/秒 で補充、最大 capacity 個。acquire は1個取れるまで待つ"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """429 の Retry-After などで、指定秒数は誰にも払い出さない"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self, stop_event=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - max(self._updated, self._paused_until)) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            if stop_event is not None:
+                if stop_event.wait(min(wait, 1.0)): return False
+            else:
+                time.sleep(min(wait, 1.0))
+
+def feature_hash(row):
+    """解説に影響する入力 (数値特徴量) のハッシュ。直前情報が変われば別の解説になる"""
+    items = sorted((k, round(float(v), 4)) for k, v in row.items() if isinstance(v, (int, float)))
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()[:12]
+
+def _prompt(row, combo, ptype):
+    data_str = "".join(f"{i}号艇:勝率{row.get(f'wr{i}', 0)}\n" for i in range(1, 5))
+    return f"買い目「{combo}」({ptype})を推奨する理由を、競艇のプロとして100文字以内で断言せよ。\nデータ:\n{data_str}"
+
+def ask_groq_reason(row, combo, ptype, bucket=None, stop_event=None):
+    """解説文を返す。失敗時は None (リトライの待ちはトークンバケット側で行う)"""
+    api_key = os.environ.get("GROQ_API_KEY", "").strip()
+    if not api_key: return None
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": [
+            {"role": "system", "content": "You are a professional boat race analyst. Answer in Japanese."},
+            {"role": "user", "content": _prompt(row, combo, ptype)}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 150
+    }
+
+    for attempt in range(MAX_ATTEMPTS):
+        if bucket is not None and not bucket.acquire(stop_event): return None
+        try:
+            with metrics.timer('groq'):
+                response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=GROQ_TIMEOUT)
+            metrics.inc('groq_requests', status=response.status_code)
+            if response.status_code == 200:
+                return response.json()['choices'][0]['message']['content']
+            print(f"⚠️ Groq API Error {response.status_code}: {response.text[:200]}", flush=True)
+            if response.status_code == 429 and bucket is not None:
+                try: retry_after = float(response.headers.get("Retry-After", 0))
+                except: retry_after = 0
+                bucket.pause(max(retry_after, 60 / max(GROQ_RPM, 1)))
+        except Exception as e:
+            print(f"⚠️ Groq Connection Error (Attempt {attempt+1}): {e}", flush=True)
+    return None
+
+# ==========================================
+# 🧵 解説サービス (プロセスで1つ)
+# ==========================================
+_lock = threading.Lock()
+_state = {
+    'queue': None,
+    'threads': [],
+    'stop': None,
+    'bucket': None,
+    'cache': collections.OrderedDict(),  # (race_key, combo, hash) -> 解説
+    'inflight': {},                      # 同じキーの依頼中 callback
+    'stats': {'requested': 0, 'cache_hits': 0, 'generated': 0, 'failed': 0, 'dropped': 0},
+}
+
+def start(workers=WORKERS):
+    with _lock:
+        if _state['threads']: return
+        _state['queue'] = queue.Queue(maxsize=QUEUE_SIZE)
+        _state['stop'] = threading.Event()
+        _state['bucket'] = TokenBucket(GROQ_RPM / 60.0, GROQ_BURST)
+        for i in range(workers):
+            t = threading.Thread(target=_worker, name=f"explainer-{i}", daemon=True)
+            t.start()
+            _state['threads'].append(t)
+
+def stop(timeout=15):
+    """積まれている依頼を timeout 秒まで処理してから止める"""
+    with _lock:
+        threads, q, stop_event = _state['threads'], _state['queue'], _state['stop']
+        _state['threads'] = []
+    if not threads: return
+    deadline = time.monotonic() + timeout
+    while not q.empty() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    stop_event.set()
+    for t in threads:
+        t.join(max(deadline - time.monotonic(), 0.1))
+    s = _state['stats']
+    print(f"🤖 AI解説: 生成{s['generated']}件 / キャッシュ{s['cache_hits']}件 / 失敗{s['failed']}件 / 破棄{s['dropped']}件", flush=True)
+
+def request_reason(race_key, row, combo, ptype, callback):
+    """キャッシュにあれば解説文を返す。無ければ生成を依頼して None を返し、生成後に callback(text or None) を呼ぶ"""
+    if not os.environ.get("GROQ_API_KEY", "").strip():
+        return NO_KEY_REASON
+
+    if not _state['threads']: start()
+    key = (race_key, combo, feature_hash(row))
+    with _lock:
+        _state['stats']['requested'] += 1
+        cached = _state['cache'].get(key)
+        if cached is not None:
+            _state['cache'].move_to_end(key)
+            _state['stats']['cache_hits'] += 1
+            return cached
+        if key in _state['inflight']:
+            _state['inflight'][key].append(callback)
+            return None
+        _state['inflight'][key] = [callback]
+
+    try:
+        _state['queue'].put_nowait((key, dict(row), combo, ptype))
+    except queue.Full:
+        with _lock:
+            _state['inflight'].pop(key, None)
+            _state['stats']['dropped'] += 1
+        print(f"⚠️ AI解説キュー満杯: {combo} を破棄", flush=True)
+    return None
+
+def _worker():
+    q, stop_event, bucket = _state['queue'], _state['stop'], _state['bucket']
+    while not stop_event.is_set():
+        try:
+            key, row, combo, ptype = q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        text = ask_groq_reason(row, combo, ptype, bucket, stop_event)
+        with _lock:
+            callbacks = _state['inflight'].pop(key, [])
+            if text:
+                _state['cache'][key] = text
+                while len(_state['cache']) > CACHE_MAX:
+                    _state['cache'].popitem(last=False)
+                _state['stats']['generated'] += 1
+            else:
+                _state['stats']['failed'] += 1
+        for cb in callbacks:
+            try: cb(text)
+            except Exception as e:
+                print(f"⚠️ AI解説コールバックエラー: {e}", flush=True)
+
+def stats():
+    with _lock:
+        return dict(_state['stats'], queued=_state['queue'].qsize() if _state['queue'] else 0, cached=len(_state['cache']))
+
+def export_cache():
+    """解説キャッシュのコピー。チェックポイント用"""
+    with _lock:
+        return list(_state['cache'].items())
+
+def import_cache(items):
+    with _lock:
+        for key, text in items:
+            _state['cache'][key] = text
+        while len(_state['cache']) > CACHE_MAX:
+            _state['cache'].popitem(last=False)
@@ -0,0 +1,111 @@
+"""
+スクレイピングした全レースの特徴量ストア (race_data.db の race_features テーブル)
+
+scrape_race_data の row dict をそのまま (date, jcd, rno) 単位で upsert し、
+結果確定後に着順・払戻を埋める。学習・シミュレーションは load_features で
+日付範囲・列を絞って読み込める (巨大CSVを毎回パースしなくてよい)。
+"""
+import datetime
+import sqlite3
+
+import db_writer
+
+TABLE = "race_features"
+# scraped_at / settled_at は history と同じ JST (Actions のランナーは UTC)
+JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+
+# scrape_race_data の出力順 + 型
+COLUMNS = [
+    ('date', 'INTEGER'), ('jcd', 'INTEGER'), ('rno', 'INTEGER'), ('wind', 'REAL'),
+    ('res1', 'INTEGER'), ('rank1', 'INTEGER'), ('rank2', 'INTEGER'), ('rank3', 'INTEGER'),
+    ('tansho', 'INTEGER'), ('nirentan', 'INTEGER'), ('sanrentan', 'INTEGER'), ('sanrenpuku', 'INTEGER'), ('payout', 'INTEGER'),
+]
+for _i in range(1, 7):
+    COLUMNS += [(f'wr{_i}', 'REAL'), (f'mo{_i}', 'REAL'), (f'ex{_i}', 'REAL'), (f'f{_i}', 'INTEGER'), (f'st{_i}', 'REAL')]
+COLUMNS += [('deadline_time', 'TEXT')]
+
+KEY = ('date', 'jcd', 'rno')
+RESULT_COLS = ('res1', 'rank1', 'rank2', 'rank3', 'tansho', 'nirentan', 'sanrentan', 'sanrenpuku', 'payout')
+PRE_RACE_COLS = tuple(c for c, _ in COLUMNS if c not in KEY and c not in RESULT_COLS)
+NAMES = [c for c, _ in COLUMNS]
+
+def init_store(conn):
+    cols = ", ".join(f"{c} {t}" for c, t in COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} ({cols}, scraped_at TEXT, settled_at TEXT, PRIMARY KEY (date, jcd, rno)) WITHOUT ROWID")
+    # 結果未確定のレースを探す用
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_unsettled ON {TABLE} (date) WHERE rank1 IS NULL")
+
+# 直前情報は最新で上書き。結果列は「取れている値」を空で潰さない
+_SET_PRE = ", ".join(f"{c}=excluded.{c}" for c in PRE_RACE_COLS)
+_SET_RES = ", ".join(
+    f"{c}=COALESCE(excluded.{c}, {TABLE}.{c})" if c.startswith('rank')
+    else f"{c}=CASE WHEN excluded.rank1 IS NOT NULL THEN excluded.{c} ELSE {TABLE}.{c} END"
+    for c in RESULT_COLS)
+UPSERT_SQL = (f"INSERT INTO {TABLE} ({', '.join(NAMES)}, scraped_at) VALUES ({', '.join('?' * len(NAMES))}, ?) "
+              f"ON CONFLICT (date, jcd, rno) DO UPDATE SET {_SET_PRE}, {_SET_RES}, scraped_at=excluded.scraped_at")
+
+def _now():
+    return datetime.datetime.now(JST).isoformat(timespec='seconds')
+
+def _values(row, scraped_at):
+    return tuple(row.get(c) for c in NAMES) + (scraped_at,)
+
+def upsert_rows(db_file, rows):
+    """スクレイピング結果をまとめて upsert (同じレースの再スキャンは1行にまとまる)"""
+    if not rows: return
+    scraped_at = _now()
+    db_writer.write_many(db_file, UPSERT_SQL, [_values(r, scraped_at) for r in rows])
+
+def update_result(db_file, date, jcd, rno, res):
+    """scrape_result の確定結果で着順・払戻を埋める"""
+    settled_at = _now()
+    r1, r2, r3 = res.get('rank1'), res.get('rank2'), res.get('rank3')
+    db_writer.write(db_file,
+        f"UPDATE {TABLE} SET res1=?, rank1=?, rank2=?, rank3=?, tansho=?, nirentan=?, sanrentan=?, sanrenpuku=?, payout=?, settled_at=? "
+        f"WHERE date=? AND jcd=? AND rno=?",
+        (1 if r1 == 1 else 0, r1, r2, r3, res.get('tansho_payout', 0), res.get('nirentan_payout', 0),
+         res.get('sanrentan_payout', 0), res.get('sanrenpuku_payout', 0), res.get('sanrentan_payout', 0), settled_at,
+         int(date), int(jcd), int(rno)))
+
+def mark_void(db_file, date, jcd, rno):
+    """中止・不成立のレース: 着順は空のまま settled_at だけ入れ、結果確認の対象から外す"""
+    db_writer.write(db_file, f"UPDATE {TABLE} SET settled_at=? WHERE date=? AND jcd=? AND rno=?",
+                    (_now(), int(date), int(jcd), int(rno)))
+
+def unsettled_races(conn, since_date, now_hhmm_by_date):
+    """結果未取得で、締切を過ぎたレースの (date, jcd, rno) を返す (mark_void 済みは除く)
+    now_hhmm_by_date: {date(int): "HH:MM"} 当日分は締切がこの時刻以前のものだけ (過去日は全て)"""
+    rows = conn.execute(f"SELECT date, jcd, rno, deadline_time FROM {TABLE} WHERE rank1 IS NULL AND settled_at IS NULL AND date >= ?", (int(since_date),)).fetchall()
+    out = []
+    for date, jcd, rno, deadline in rows:
+        limit = now_hhmm_by_date.get(date)
+        if limit is not None and (not deadline or deadline == "00:00" or deadline > limit): continue
+        out.append((date, jcd, rno))
+    return out
+
+def load_features(db_file, start_date=None, end_date=None, columns=None, settled_only=False):
+    """日付範囲 (YYYYMMDD, 両端含む) と列を指定して DataFrame で読み込む"""
+    import pandas as pd
+
+    cols = list(columns) if columns else NAMES
+    for k in reversed(KEY):
+        if k not in cols: cols.insert(0, k)
+    unknown = [c for c in cols if c not in NAMES]
+    if unknown: raise ValueError(f"unknown columns: {unknown}")
+
+    where, params = [], []
+    if start_date is not None:
+        where.append("date >= ?"); params.append(int(start_date))
+    if end_date is not None:
+        where.append("date <= ?"); params.append(int(end_date))
+    if settled_only:
+        where.append("rank1 IS NOT NULL")
+    sql = f"SELECT {', '.join(cols)} FROM {TABLE}"
+    if where: sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date, jcd, rno"
+
+    conn = sqlite3.connect(db_file)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
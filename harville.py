@@ -0,0 +1,43 @@
+"""
+着順モデル (1着 / 2着 / 3着 の各6艇確率) から、3連単120通り・2連単30通りの確率を一括計算する
+
+Harville 型の条件付き確率を、位置ごとのモデルで置き換えたもの:
+  P(i-j-k) ∝ P1[i] × P2[j] / (1 - P2[i]) × P3[k] / (1 - P3[i] - P3[j])
+  P(i-j)   ∝ P1[i] × P2[j] / (1 - P2[i])
+各レースで合計1に正規化する。入力は (レース数, 6)、出力は (レース数, 120) / (レース数, 30)。
+買い目の並びは辞書順で、scraper.TRIFECTA_COMBOS / EXACTA_COMBOS と同じ。
+"""
+import itertools
+
+import numpy as np
+
+TRIFECTA_COMBOS = [f"{a}-{b}-{c}" for a, b, c in itertools.permutations(range(1, 7), 3)]
+EXACTA_COMBOS = [f"{a}-{b}" for a, b in itertools.permutations(range(1, 7), 2)]
+# (n, 6, 6, 6) / (n, 6, 6) を平らにしたときの各買い目の位置
+_TRI_FLAT = np.array([a * 36 + b * 6 + c for a, b, c in itertools.permutations(range(6), 3)])
+_EXA_FLAT = np.array([a * 6 + b for a, b in itertools.permutations(range(6), 2)])
+
+EPS = 1e-9
+
+def _normalize(p):
+    p = np.maximum(np.asarray(p, dtype=np.float64), 0.0)
+    s = p.sum(axis=1, keepdims=True)
+    return np.where(s > 0, p / np.where(s > 0, s, 1.0), 1.0 / p.shape[1])
+
+def _finish(w):
+    # 確率が全て同じ艇に集中した (one-hot が重なった) レースは全買い目 0 のまま返す → 呼び出し側で除外
+    s = w.sum(axis=1, keepdims=True)
+    return w / np.where(s > 0, s, 1.0)
+
+def _first_two(p1, p2):
+    # (n, 6, 6): P1[i] × P2[j] / (1 - P2[i])  (i == j の成分は後で捨てる)
+    return (p1 / np.maximum(1 - p2, EPS))[:, :, None] * p2[:, None, :]
+
+def combo_probs(p1, p2, p3):
+    """(3連単 (n, 120), 2連単 (n, 30)) をまとめて計算 (1着・2着部分を共有)"""
+    p1, p2, p3 = _normalize(p1), _normalize(p2), _normalize(p3)
+    n = len(p1)
+    first_two = _first_two(p1, p2)
+    rest = p3[:, None, None, :] / np.maximum(1 - p3[:, :, None] - p3[:, None, :], EPS)[:, :, :, None]
+    tri = (first_two[:, :, :, None] * rest).reshape(n, 216)[:, _TRI_FLAT]
+    return _finish(tri), _finish(first_two.reshape(n, 36)[:, _EXA_FLAT])
@@ -0,0 +1,150 @@
+"""
+HTTP レスポンスの記録・再生 (オフラインでのベンチマーク / 過去日のリプレイ用)
+
+  HTTP_ARCHIVE_MODE=record  : scraper が取得した全レスポンスをアーカイブに保存
+  HTTP_ARCHIVE_MODE=replay  : ネットワークに出ず、アーカイブから記録時の待ち時間付きで返す
+                              (同じURLは記録順に返す。set_mode(..., predicted=True) なら
+                               レースごとに予測直前の1件だけを返す: 1パスで本番の推奨を再現する用)
+
+保存形式:
+  <HTTP_ARCHIVE_DIR>/<日付>/objects/<sha256>.gz   本文 (gzip, 内容アドレス)
+  <HTTP_ARCHIVE_DIR>/<日付>/index.jsonl           1行1レスポンス (url, status, sha256, latency, headers)
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+MODE = os.environ.get("HTTP_ARCHIVE_MODE", "")
+ARCHIVE_DIR = os.environ.get("HTTP_ARCHIVE_DIR", "http_archive")
+REPLAY_LATENCY = os.environ.get("HTTP_ARCHIVE_LATENCY", "1") != "0"  # 0 なら待ち時間なしで再生
+REPLAY_PREDICTED = False  # True なら記録順ではなく、各レースの予測直前のレスポンスを返す
+
+# 本番は予測に回すレースだけ、取得の直後にオッズを取る → そのレースの最後のオッズ取得 = 予測した時点
+ODDS_PAGES = ("odds3t", "odds2tf")
+
+_lock = threading.Lock()
+# url -> [record, ...] / url -> 次に返す位置 / (日付, jcd, rno) -> 予測した時点 (最後のオッズ取得の fetched_at)
+_replay = {'loaded': set(), 'entries': {}, 'cursor': {}, 'predicted_at': {}}
+
+class ArchivedResponse:
+    """curl_cffi のレスポンスと同じ属性だけを持つ再生用オブジェクト"""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+def set_mode(mode, archive_dir=None, latency=None, predicted=None):
+    global MODE, ARCHIVE_DIR, REPLAY_LATENCY, REPLAY_PREDICTED
+    MODE = mode
+    if archive_dir: ARCHIVE_DIR = archive_dir
+    if latency is not None: REPLAY_LATENCY = latency
+    if predicted is not None: REPLAY_PREDICTED = predicted
+
+def is_recording():
+    return MODE == "record"
+
+def is_replaying():
+    return MODE == "replay"
+
+def _date_of(url):
+    hd = parse_qs(urlsplit(url).query).get("hd")
+    return hd[0] if hd else time.strftime("%Y%m%d")
+
+def _race_of(url):
+    """(日付, jcd, rno)。レース単位のページでなければ None"""
+    q = parse_qs(urlsplit(url).query)
+    if not (q.get("jcd") and q.get("rno")): return None
+    return _date_of(url), int(q["jcd"][0]), int(q["rno"][0])
+
+def record(url, res, latency):
+    content = res.content or b""
+    sha = hashlib.sha256(content).hexdigest()
+    day_dir = os.path.join(ARCHIVE_DIR, _date_of(url))
+    obj_dir = os.path.join(day_dir, "objects")
+    entry = {
+        'url': url,
+        'status': res.status_code,
+        'sha256': sha,
+        'latency': round(latency, 4),
+        'headers': {k: res.headers.get(k) for k in ('ETag', 'Last-Modified') if res.headers.get(k)},
+        'fetched_at': time.time(),
+    }
+    try:
+        with _lock:
+            os.makedirs(obj_dir, exist_ok=True)
+            obj = os.path.join(obj_dir, f"{sha}.gz")
+            if not os.path.exists(obj):
+                with gzip.open(obj + ".tmp", "wb") as f:
+                    f.write(content)
+                os.replace(obj + ".tmp", obj)
+            with open(os.path.join(day_dir, "index.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ アーカイブ保存失敗: {e}", flush=True)
+
+def _load_day(date_str):
+    if date_str in _replay['loaded']: return
+    _replay['loaded'].add(date_str)
+    path = os.path.join(ARCHIVE_DIR, date_str, "index.jsonl")
+    if not os.path.exists(path): return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try: entry = json.loads(line)
+            except: continue
+            _replay['entries'].setdefault(entry['url'], []).append(entry)
+            race = _race_of(entry['url'])
+            if race and urlsplit(entry['url']).path.rsplit("/", 1)[-1] in ODDS_PAGES:
+                fetched_at = entry.get('fetched_at', 0)
+                _replay['predicted_at'][race] = max(_replay['predicted_at'].get(race, 0), fetched_at)
+
+def _pick(url, entries):
+    if REPLAY_PREDICTED:
+        # 予測した時点までに記録された最後の1件 (予測しなかったレース・会場単位のページは最後の1件)
+        # 予測後に取った結果ページなどは返さない
+        cutoff = _replay['predicted_at'].get(_race_of(url))
+        before = [e for e in entries if cutoff is None or e.get('fetched_at', 0) <= cutoff]
+        return (before or entries[:1])[-1]
+    pos = _replay['cursor'].get(url, 0)
+    _replay['cursor'][url] = pos + 1
+    return entries[min(pos, len(entries) - 1)]
+
+def lookup(url):
+    """記録順に1件ずつ返す (同じURLが複数回記録されていれば、最後の1件を返し続ける)。未記録なら None
+    REPLAY_PREDICTED なら何度呼んでも、そのレースの予測直前の1件"""
+    with _lock:
+        _load_day(_date_of(url))
+        entries = _replay['entries'].get(url)
+        if not entries: return None
+        entry = _pick(url, entries)
+    try:
+        with gzip.open(os.path.join(ARCHIVE_DIR, _date_of(url), "objects", f"{entry['sha256']}.gz"), "rb") as f:
+            content = f.read()
+    except Exception:
+        return None
+    return entry, ArchivedResponse(entry['status'], content, entry.get('headers', {}))
+
+def replay(url):
+    found = lookup(url)
+    if found is None:
+        return ArchivedResponse(404, b"", {})
+    entry, res = found
+    if REPLAY_LATENCY: time.sleep(entry['latency'])
+    return res
+
+async def async_replay(url):
+    found = lookup(url)
+    if found is None:
+        return ArchivedResponse(404, b"", {})
+    entry, res = found
+    if REPLAY_LATENCY: await asyncio.sleep(entry['latency'])
+    return res
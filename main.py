@@ -1,92 +1,252 @@
-import os
 import datetime
+import signal
 import time
 import sqlite3
 import concurrent.futures
 import threading
 import sys
-import requests as std_requests
 import json
-import pandas as pd
 
 # 自作モジュール
-from scraper import scrape_race_data, get_session
-from predict_boat import predict_race
+import checkpoint
+import db_writer
+import explainer
+import feature_store
+import metrics
+import notifier
+import scraper
+from scraper import scrape_races, scrape_deadlines, scrape_open_venues, scrape_result, scrape_odds_many, get_session, close_async
+from scheduler import RaceScheduler, parse_deadline, exhibition_ready
 
 DB_FILE = "race_data.db"
 PLACE_NAMES = {i: n for i, n in enumerate(["","桐生","戸田","江戸川","平和島","多摩川","浜名湖","蒲郡","常滑","津","三国","びわこ","住之江","尼崎","鳴門","丸亀","児島","宮島","徳山","下関","若松","芦屋","福岡","唐津","大村"])}
 JST = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+SCAN_INTERVAL = 60  # スケジューラの最大待機秒数
+DISCOVERY_RETRY_SEC = 1800  # 開催情報が取れなかった場合の再確認間隔
+RESULT_LOOKBACK_DAYS = 2    # 特徴量ストアの結果を埋めに行く日数
+RESULT_GIVEUP_DAYS = 7      # これより古いレースの結果ページに着順・払戻が無ければ EXPIRED (払戻不明) にして確認をやめる
+WARMUP_WAIT_SEC = 120       # 最初の予測でモデル準備を待つ上限
+LEGACY_STATUS_FILE = "status.json"  # 旧方式の通知済みリスト (v5 で history へ移行。None なら移行しない)
 
 sys.stdout.reconfigure(encoding='utf-8')
 
 def log(msg):
     print(msg, flush=True)
 
+# ==========================================
+# 🧠 モデルの準備はバックグラウンドで (pandas / lightgbm の import ごと)
+# ==========================================
+_models_ready = threading.Event()
+
+def start_warmup():
+    """モデルのロードを別スレッドで始める。開催確認・最初の取得はその間に進める"""
+    def run():
+        try:
+            import predict_boat
+            predict_boat.warmup_models()
+        except Exception as e:
+            log(f"⚠️ モデル準備エラー: {e}")
+        finally:
+            _models_ready.set()
+    threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+def wait_models(timeout=WARMUP_WAIT_SEC):
+    if not _models_ready.wait(timeout):
+        log("⚠️ モデル準備待ちタイムアウト")
+
+def predict_races(rows, snaps=None):
+    wait_models()
+    import predict_boat
+    # 締切順に取りに行くので1サイクル1レースが多い → 特徴量プラン + Booster 直呼びの1レース経路
+    if len(rows) == 1:
+        return [predict_boat.predict_race(rows[0], snaps[0] if snaps else None)]
+    return predict_boat.predict_races(rows, snaps)
+
 def send_discord(content):
-    url = os.environ.get("DISCORD_WEBHOOK_URL")
-    if not url: return
+    # 送信スレッドに積むだけ (まとめ送信・429待ちは notifier 側)
+    notifier.send(content)
+
+STAKE = 1000  # 1点あたりの購入額
+
+def _migrate_v2(conn):
+    """v1 → v2: race_id に埋め込まれていた情報を列に展開し、索引を張る"""
+    for col in ("jcd INTEGER", "bet_type TEXT", "stake INTEGER", "payout INTEGER", "odds REAL", "settled_at TEXT"):
+        conn.execute(f"ALTER TABLE history ADD COLUMN {col}")
+
+    rows = conn.execute("SELECT race_id, predict_combo, status, profit FROM history").fetchall()
+    updates = []
+    for race_id, combo, status, profit in rows:
+        try: jcd = int(race_id.split('_')[1])
+        except: jcd = None
+        bet_type = '3連単' if str(combo).count("-") == 2 else '2連単'
+        payout = (profit or 0) + STAKE if status == 'FINISHED' else None
+        updates.append((jcd, bet_type, STAKE, payout, race_id))
+    conn.executemany("UPDATE history SET jcd=?, bet_type=?, stake=?, payout=? WHERE race_id=?", updates)
+
+    # 結果待ちだけの部分索引 (レポーターのポーリング用) と、日付・会場別集計用
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_pending ON history (date, jcd, race_no) WHERE status='PENDING'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_date_place ON history (date, place)")
+
+def _migrate_v4(conn):
+    """v3 → v4: AI解説は後から届くので履歴側に保存する"""
+    conn.execute("ALTER TABLE history ADD COLUMN reason TEXT")
 
+def _migrate_v5(conn):
+    """v4 → v5: status.json の通知済みリストを history に取り込む (以後、重複判定は history だけを見る)
+    追跡していなかった買い目なので status='LEGACY' (結果確認・収支集計の対象外) で入れる"""
+    if not LEGACY_STATUS_FILE: return
     try:
-        resp = std_requests.post(url, json={"content": content}, timeout=10)
-        if 200 <= resp.status_code < 300:
-            log(f"✅ Discord送信成功: {resp.status_code}")
-        else:
-            log(f"💀 Discord送信失敗: Code {resp.status_code}")
-    except Exception as e:
-        log(f"💀 Discord接続エラー: {e}")
+        with open(LEGACY_STATUS_FILE, encoding="utf-8") as f:
+            notified = json.load(f).get('notified', [])
+    except FileNotFoundError:
+        return
+    rows = []
+    for n in notified:
+        try: jcd, rno, date, combo = int(n['jcd']), int(n['rno']), str(n['date']), n['combo']
+        except: continue
+        bet_type = '3連単' if combo.count("-") == 2 else '2連単'
+        rows.append((f"{date}_{jcd}_{rno}_{combo}", date, PLACE_NAMES.get(jcd, ""), rno, combo, 'LEGACY', jcd, bet_type))
+    # stake / profit は入れない (既に history にあるものはそのまま)
+    conn.executemany("INSERT OR IGNORE INTO history (race_id, date, place, race_no, predict_combo, status, jcd, bet_type) VALUES (?,?,?,?,?,?,?,?)", rows)
+    log(f"📦 {LEGACY_STATUS_FILE} の通知済み {len(rows)}件を履歴へ移行")
+
+# PRAGMA user_version に対応するマイグレーション (順番に適用)
+MIGRATIONS = [
+    (2, _migrate_v2),
+    (3, feature_store.init_store),  # v3: 全レースの特徴量ストア
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+]
+
+def migrate_db(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, fn in MIGRATIONS:
+        if version >= target: continue
+        # ALTER TABLE も含めて1トランザクション (途中で落ちても旧スキーマのまま)
+        conn.execute("BEGIN")
+        with conn:
+            fn(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+        log(f"💾 DBスキーマ更新: v{version} → v{target}")
+        version = target
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = db_writer.connect(DB_FILE)
     # ★本番仕様: DROP TABLEを削除し、データを永続化させる
     conn.execute("CREATE TABLE IF NOT EXISTS history (race_id TEXT PRIMARY KEY, date TEXT, place TEXT, race_no INTEGER, predict_combo TEXT, status TEXT, profit INTEGER)")
+    # 当日の開催会場・締切時刻のキャッシュ (再起動しても開催確認をやり直さない)
+    conn.execute("CREATE TABLE IF NOT EXISTS schedule (date TEXT, jcd INTEGER, rno INTEGER, deadline TEXT, PRIMARY KEY (date, jcd, rno))")
+    # 開催一覧ページで確認した当日の開催会場 (schedule が全会場分揃っているかの判定用)
+    conn.execute("CREATE TABLE IF NOT EXISTS schedule_venues (date TEXT, jcd INTEGER, PRIMARY KEY (date, jcd))")
+    conn.commit()
+    migrate_db(conn)
     conn.close()
     log("💾 DB接続完了（履歴保持モード）")
 
+def settle_bet(combo, res):
+    """買い目と確定結果から (的中したか, 払戻額, 結果の買い目) を返す。1点 STAKE 円購入"""
+    if str(combo).count("-") == 2:
+        result_str = res.get('sanrentan_combo')
+        payout = res.get('sanrentan_payout', 0) * STAKE // 100
+    else:
+        result_str = res.get('nirentan_combo')
+        payout = res.get('nirentan_payout', 0) * STAKE // 100
+    if not result_str: return None
+    hit = result_str == combo
+    return hit, (payout if hit else 0), result_str
+
+def report_pass(sess):
+    """PENDINGの買い目をレース単位でまとめて結果確認し、1トランザクションで確定させる"""
+    conn = db_writer.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    # idx_history_pending (部分索引) だけを読むので、履歴が増えても一定時間
+    pending = conn.execute("SELECT race_id, date, jcd, place, race_no, predict_combo, stake FROM history WHERE status='PENDING'").fetchall()
+
+    # (date, jcd, rno) ごとにまとめる → 1レース1回の結果取得で全買い目を確定
+    races = {}
+    for p in pending:
+        if p['jcd'] is None: continue
+        races.setdefault((str(p['date']), p['jcd'], p['race_no']), []).append(p)
+
+    # 買っていないレースも、特徴量ストアの結果欄を埋めるために確認する (直近 RESULT_LOOKBACK_DAYS 日分)
+    now = datetime.datetime.now(JST)
+    since = (now - datetime.timedelta(days=RESULT_LOOKBACK_DAYS)).strftime('%Y%m%d')
+    for date, jcd, rno in feature_store.unsettled_races(conn, since, {int(now.strftime('%Y%m%d')): now.strftime('%H:%M')}):
+        races.setdefault((str(date), jcd, rno), [])
+
+    settled_at = datetime.datetime.now(JST).isoformat(timespec='seconds')
+    giveup = (now - datetime.timedelta(days=RESULT_GIVEUP_DAYS)).strftime('%Y%m%d')
+
+    updates = []
+    voids = []    # 中止・不成立 (返還): (payout, settled_at, race_id)
+    expired = []  # 結果ページに着順・払戻が無いまま古くなった (払戻不明): (settled_at, race_id)
+    messages = []
+    for (date, jcd, rno), bets in races.items():
+        res = scrape_result(sess, jcd, rno, date)
+        # 取得失敗 (タイムアウト・ブロック・サーキット遮断) は次のパスで取り直す。ここで諦めることはしない
+        if not res: continue
+        if res.get('unsettled'):
+            # 結果ページは取れたのに、古いレースでまだ着順・払戻が無ければ諦める (収支には入れない)
+            if date < giveup and bets:
+                log(f"⌛ {bets[0]['place']}{rno}R ({date}) 結果ページに{RESULT_GIVEUP_DAYS}日以上着順・払戻なし: {len(bets)}件を EXPIRED")
+                expired += [(settled_at, p['race_id']) for p in bets]
+            continue
+        if res.get('void'):
+            # 中止・不成立: 舟券は返還 (収支 0)
+            feature_store.mark_void(DB_FILE, date, jcd, rno)
+            if bets: log(f"🚫 {bets[0]['place']}{rno}R 中止・不成立: {len(bets)}件を返還扱い")
+            voids += [(p['stake'] or STAKE, settled_at, p['race_id']) for p in bets]
+            continue
+        feature_store.update_result(DB_FILE, date, jcd, rno, res)
+
+        for p in bets:
+            combo = p['predict_combo']
+            settled = settle_bet(combo, res)
+            if not settled: continue
+            hit, payout, result_str = settled
+            stake = p['stake'] or STAKE
+            profit = int(payout - stake)
+            updates.append((profit, int(payout), settled_at, p['race_id']))
+
+            if hit:
+                msg = f"🎯 **{p['place']}{p['race_no']}R** 的中！！\n買い目: **{combo}**\n払戻: {int(payout):,}円\n収支: +{profit:,}円"
+                log(f"🎯 {p['place']}{p['race_no']}R 的中！ {combo} (+{profit}円)")
+                messages.append((p['race_id'], msg))
+            else:
+                log(f"💀 {p['place']}{p['race_no']}R ハズレ... 予想:{combo} 結果:{result_str}")
+
+    conn.close()
+    # 1パス分の更新はまとめて1コミット (書き込みスレッド経由)
+    if updates:
+        db_writer.write_many(DB_FILE, "UPDATE history SET status='FINISHED', profit=?, payout=?, settled_at=? WHERE race_id=?", updates)
+    if voids:
+        db_writer.write_many(DB_FILE, "UPDATE history SET status='VOID', profit=0, payout=?, settled_at=? WHERE race_id=?", voids)
+    if expired:
+        db_writer.write_many(DB_FILE, "UPDATE history SET status='EXPIRED', profit=NULL, payout=NULL, settled_at=? WHERE race_id=?", expired)
+
+    # 的中通知は確定がコミットされてから。通知する行そのものを読み直して確かめる
+    # (書けなかった行は PENDING のままなので、次のパスで確定・通知し直す)
+    if messages:
+        db_writer.flush()
+        conn = db_writer.connect(DB_FILE)
+        ids = [race_id for race_id, _ in messages]
+        finished = {r[0] for r in conn.execute(
+            f"SELECT race_id FROM history WHERE status='FINISHED' AND race_id IN ({','.join('?' * len(ids))})", ids)}
+        conn.close()
+        if len(finished) < len(ids):
+            log(f"⚠️ 結果の書き込みが確認できない的中 {len(ids) - len(finished)}件は通知を見送り")
+        messages = [(race_id, msg) for race_id, msg in messages if race_id in finished]
+    for _, msg in messages:
+        send_discord(msg)
+    return len(updates) + len(voids) + len(expired)
+
 def report_worker(stop_event):
+    # セッションは使い回す (毎回作るとTLSハンドシェイクからやり直しになる)
+    sess = get_session()
     while not stop_event.is_set():
         try:
-            conn = sqlite3.connect(DB_FILE)
-            conn.row_factory = sqlite3.Row
-            pending = conn.execute("SELECT * FROM history WHERE status='PENDING'").fetchall()
-            sess = get_session()
-            for p in pending:
-                try: jcd = int(p['race_id'].split('_')[1])
-                except: continue
-                
-                from scraper import scrape_result
-                res = scrape_result(sess, jcd, p['race_no'], p['date'])
-                if not res: continue
-
-                hit = False
-                payout = 0
-                combo = p['predict_combo']
-                result_str = "未確定"
-                
-                if str(combo).count("-") == 2:
-                    if res.get('sanrentan_combo'):
-                        result_str = res['sanrentan_combo']
-                        if res['sanrentan_combo'] == combo:
-                            hit = True
-                            payout = res.get('sanrentan_payout', 0) * 10
-                else:
-                    if res.get('nirentan_combo'):
-                        result_str = res['nirentan_combo']
-                        if res['nirentan_combo'] == combo:
-                            hit = True
-                            payout = res.get('nirentan_payout', 0) * 10
-                
-                if result_str != "未確定":
-                    profit = int(payout - 1000)
-                    conn.execute("UPDATE history SET status='FINISHED', profit=? WHERE race_id=?", (profit, p['race_id']))
-                    conn.commit()
-                    
-                    if hit:
-                        msg = f"🎯 **{p['place']}{p['race_no']}R** 的中！！\n買い目: **{combo}**\n払戻: {int(payout):,}円\n収支: +{profit:,}円"
-                        log(f"🎯 {p['place']}{p['race_no']}R 的中！ {combo} (+{profit}円)")
-                        send_discord(msg)
-                    else:
-                        log(f"💀 {p['place']}{p['race_no']}R ハズレ... 予想:{combo} 結果:{result_str}")
-            conn.close()
+            with metrics.timer('report'):
+                report_pass(sess)
         except Exception as e:
             log(f"Report Error: {e}")
         
@@ -94,91 +254,342 @@ def report_worker(stop_event):
             if stop_event.is_set(): break
             time.sleep(60)
 
-def process_race(jcd, rno, today):
-    sess = get_session()
+def usable_row(jcd, rno, raw, error):
+    """スクレイピング結果が予測に使えれば行dictを、使えなければ None を返す"""
     place = PLACE_NAMES[jcd]
-    try:
-        raw, error = scrape_race_data(sess, jcd, rno, today)
-    except Exception as e:
-        return
-
-    if error: return
-    if not raw or raw.get('wr1', 0) == 0: return
+    if error: return None
+    if not raw or raw.get('wr1', 0) == 0: return None
 
     log(f"✅ {place}{rno}R 取得完了 ------------------------------")
     log("----------------------------------------------------------")
+    return raw
 
-    try: preds = predict_race(raw)
-    except: return
+def _reason_arrived(race_id, place, rno, combo):
+    """AI解説が届いたら履歴に保存し、追記として通知する (解説サービスのスレッドで呼ばれる)"""
+    def callback(reason):
+        if not reason:
+            log(f"⚠️ AI解説取得失敗: {place}{rno}R {combo}")
+            return
+        db_writer.write(DB_FILE, "UPDATE history SET reason=? WHERE race_id=?", (reason, race_id))
+        send_discord(f"📝 **{place}{rno}R** {combo} のAI解説\n{reason}")
+    return callback
+
+# ==========================================
+# 🔁 通知済みの買い目 (当日分はメモリの set で判定)
+# ==========================================
+# INSERT は書き込みスレッド経由で遅れてコミットされるため、DB を SELECT するより確実
+_notified_lock = threading.Lock()
+_notified = {'date': None, 'ids': set()}
+
+def load_notified(today):
+    """当日の history から通知済み race_id を読み込む (起動時・日付変更時に1回)"""
+    conn = db_writer.connect(DB_FILE)
+    ids = {r[0] for r in conn.execute("SELECT race_id FROM history WHERE date=?", (str(today),))}
+    conn.close()
+    with _notified_lock:
+        _notified['date'], _notified['ids'] = str(today), ids
+    return len(ids)
+
+def claim_notification(today, race_id):
+    """未通知なら通知済みにして True (判定と登録は同じロックの中)。当日以外は DB で確認する"""
+    with _notified_lock:
+        if _notified['date'] == str(today):
+            if race_id in _notified['ids']: return False
+            _notified['ids'].add(race_id)
+            return True
+    conn = db_writer.connect(DB_FILE)
+    exists = conn.execute("SELECT 1 FROM history WHERE race_id=?", (race_id,)).fetchone()
+    conn.close()
+    return not exists
+
+def record_predictions(jcd, rno, today, preds, raw=None):
     if not preds: return
+    place = PLACE_NAMES[jcd]
 
-    conn = sqlite3.connect(DB_FILE)
     for p in preds:
         combo = p['combo']
         race_id = f"{today}_{jcd}_{rno}_{combo}"
         
         # 重複チェック（既に通知済みならスキップ）
-        exists = conn.execute("SELECT 1 FROM history WHERE race_id=?", (race_id,)).fetchone()
-        
-        if not exists:
+        if claim_notification(today, race_id):
             ptype = p.get('type', '不明')
             profit = p.get('profit', 0)
             prob = p.get('prob', 0)
             roi = p.get('roi', 0)
-            reason = p.get('reason', 'AI解説なし')
-            
             log(f"🔥 [HIT] {place}{rno}R -> {combo} (期待値:{profit}円/確率:{prob}%)")
-            odds_url = f"https://www.boatrace.jp/owpc/pc/race/odds3t?rno={rno}&jcd={jcd:02d}&hd={today}"
+            metrics.inc('picks', type=ptype)
+            db_writer.write(DB_FILE,
+                "INSERT OR IGNORE INTO history (race_id, date, place, race_no, predict_combo, status, profit, jcd, bet_type, stake, odds) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (race_id, today, place, rno, combo, 'PENDING', 0, jcd, ptype, STAKE, p.get('odds')))
+
+            # 解説はキャッシュにあればその場で、無ければ生成を依頼して後から追記 (ここでは待たない)
+            # ※INSERT を先に積むので、追記の UPDATE が先にコミットされることはない
+            reason = explainer.request_reason((today, jcd, rno), raw or {}, combo, ptype,
+                                              _reason_arrived(race_id, place, rno, combo))
+            if reason:
+                db_writer.write(DB_FILE, "UPDATE history SET reason=? WHERE race_id=?", (reason, race_id))
 
+            odds_url = f"https://www.boatrace.jp/owpc/pc/race/odds3t?rno={rno}&jcd={jcd:02d}&hd={today}"
+            odds = p.get('odds')
+            # EV = モデルの買い目確率 × オッズ (推奨時に全買い目まとめて計算済み)
+            odds_line = f"📈 オッズ: **{odds:.1f}倍** (EV {p['ev']:.2f})\n" if odds and p.get('ev') is not None else ""
             msg = (
                 f"🔥 **{place}{rno}R** AI激熱予想\n"
                 f"🎯 買い目: **{combo}** ({ptype})\n"
                 f"💰 期待値: **+{profit}円**\n"
                 f"📊 自信度: **{prob}%** (回収率:{roi}%)\n"
-                f"📝 **AI解説**: {reason}\n"
+                f"{odds_line}"
+                f"📝 **AI解説**: {reason or '生成中 (後ほど追記)'}\n"
                 f"🔗 [オッズ確認・投票]({odds_url})"
             )
-            
-            conn.execute("INSERT INTO history VALUES (?,?,?,?,?,?,?)", (race_id, today, place, rno, combo, 'PENDING', 0))
-            conn.commit()
             send_discord(msg)
-            
+
+def load_cached_schedule(today):
+    conn = db_writer.connect(DB_FILE)
+    rows = conn.execute("SELECT jcd, rno, deadline FROM schedule WHERE date=?", (today,)).fetchall()
+    conn.close()
+    schedule = {}
+    for jcd, rno, deadline in rows:
+        schedule.setdefault(jcd, {})[rno] = deadline
+    return schedule
+
+def save_schedule(today, schedule):
+    db_writer.write_many(DB_FILE, "INSERT OR REPLACE INTO schedule VALUES (?,?,?,?)",
+                         [(today, jcd, rno, hhmm) for jcd, races in schedule.items() for rno, hhmm in races.items()])
+
+def load_open_venues(today):
+    """保存済みの開催会場のリスト。まだ確認していなければ None"""
+    conn = db_writer.connect(DB_FILE)
+    rows = conn.execute("SELECT jcd FROM schedule_venues WHERE date=?", (today,)).fetchall()
     conn.close()
+    return sorted(r[0] for r in rows) or None
+
+def save_open_venues(today, venues):
+    db_writer.write_many(DB_FILE, "INSERT OR IGNORE INTO schedule_venues VALUES (?,?)", [(today, jcd) for jcd in venues])
+
+_fallback_probed = set()  # 開催一覧が取れず全24場を確認した日 (総当たりは1日1回まで)
+
+def discover_races(today):
+    """当日の開催会場と全レースの締切を取得する。結果は日単位でDBにキャッシュ
+    戻り値は ({jcd: {rno: "HH:MM"}}, 開催一覧の全会場の締切が揃ったか)。
+    揃っていなければ、呼ぶたびに足りない会場だけ取り直す"""
+    schedule = load_cached_schedule(today)
+
+    # 開催一覧ページ1枚で開催場を絞る (会場リンクが無いページは取得失敗と同じ扱いで、保存しない)
+    venues = load_open_venues(today)
+    if venues is None:
+        try: venues = scrape_open_venues(get_session(), today)
+        except: venues = None
+        if venues: save_open_venues(today, venues)
+    if venues and all(j in schedule for j in venues):
+        log(f"🗓️ 開催情報: {len(schedule)}場")
+        return schedule, True
+
+    if venues is None:
+        # 開催一覧が取れなければ全24場を確認 (どこが開催か分からないので、揃ったことにはしない)
+        # 総当たりは1日1回。以降の再確認は開催一覧ページだけ
+        if today in _fallback_probed:
+            log(f"⚠️ 開催一覧が取得できません: {DISCOVERY_RETRY_SEC // 60}分後に再確認")
+            return schedule, False
+        _fallback_probed.add(today)
+    missing = [j for j in (venues or range(1, 25)) if j not in schedule]
+
+    def fetch(jcd):
+        try: return jcd, scrape_deadlines(get_session(), jcd, today)
+        except: return jcd, {}
+
+    found = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as ex:
+        for jcd, deadlines in ex.map(fetch, missing):
+            if deadlines: found[jcd] = deadlines
+
+    if found:
+        save_schedule(today, found)
+        schedule.update(found)
+    complete = bool(venues) and all(j in schedule for j in venues)
+    if not complete:
+        lacking = "・".join(PLACE_NAMES[j] for j in (venues or []) if j not in schedule) or "開催一覧未取得"
+        log(f"⚠️ 開催情報が揃っていません ({lacking}): {DISCOVERY_RETRY_SEC // 60}分後に再確認")
+    return schedule, complete
+
+def load_schedule(scheduler, today, now=None):
+    """開催情報をスケジューラに登録し、全会場分揃ったかを返す (now 時点で締切を過ぎたレースは除外)
+    登録済みのレースはそのまま (再確認で足りなかった会場だけが増える)"""
+    schedule, complete = discover_races(today)
+    now = now or datetime.datetime.now(JST)
+    for jcd, races in schedule.items():
+        for rno, hhmm in races.items():
+            deadline = parse_deadline(today, hhmm, JST)
+            if deadline and deadline > now:
+                scheduler.add(jcd, rno, deadline)
+    names = "・".join(PLACE_NAMES[j] for j in sorted(schedule))
+    log(f"🗓️ 本日の開催: {len(schedule)}場 ({names}) / 残り{scheduler.pending_count()}レース")
+    return complete
+
+def scan_cycle(targets, today, scheduler):
+    """targets の (jcd, rno) を非同期で一括取得し、展示が確定したレースをまとめて1回で推論する"""
+    rows = []
+    now = datetime.datetime.now(JST)
+    try:
+        with metrics.timer('scrape'):
+            results = scrape_races(targets, today)
+    except Exception as e:
+        log(f"⚠️ 一括取得エラー: {e}")
+        results = [(None, "ERROR")] * len(targets)
+
+    scraped = []
+    for (jcd, rno), (raw, error) in zip(targets, results):
+        raw = usable_row(jcd, rno, raw, error)
+        if raw:
+            scraped.append(raw)
+            scheduler.update_deadline(jcd, rno, parse_deadline(today, raw.get('deadline_time'), JST))
+        if raw and (exhibition_ready(raw) or scheduler.is_last_chance(jcd, rno, now)):
+            rows.append(raw)
+            scheduler.complete(jcd, rno)
+        else:
+            scheduler.reschedule(jcd, rno, now)
+
+    metrics.inc('races_targeted', len(targets))
+    metrics.inc('races_scraped', len(scraped))
+    # 取得できた行は全て特徴量ストアへ (再スキャン分は同じ行に上書き)
+    feature_store.upsert_rows(DB_FILE, scraped)
+
+    if not rows: return
+    # 予測に回すレースの締切直前オッズを一括取得 (全買い目の期待値で推奨を選ぶ)
+    try:
+        with metrics.timer('odds'):
+            snaps = scrape_odds_many([(int(raw['jcd']), int(raw['rno'])) for raw in rows], today)
+    except Exception as e:
+        log(f"⚠️ オッズ取得エラー: {e}")
+        snaps = [None] * len(rows)
+    try:
+        with metrics.timer('predict'):
+            all_preds = predict_races(rows, snaps)
+    except Exception as e:
+        log(f"⚠️ 一括予測エラー: {e}")
+        return
+    metrics.inc('races_predicted', len(rows))
+
+    with metrics.timer('record'):
+        for raw, preds in zip(rows, all_preds):
+            try: record_predictions(int(raw['jcd']), int(raw['rno']), today, preds, raw)
+            except Exception as e:
+                log(f"⚠️ 記録エラー: {e}")
+
+# ==========================================
+# 💾 チェックポイント (Actions のセッションをまたいで状態を引き継ぐ)
+# ==========================================
+def save_checkpoint(scheduler, schedule_day):
+    since = (datetime.datetime.now(JST) - datetime.timedelta(days=RESULT_LOOKBACK_DAYS)).strftime('%Y%m%d')
+    state = {
+        'date': schedule_day,
+        'scheduler': scheduler.snapshot() if scheduler is not None else None,
+        'results': scraper.export_results(since),
+        'reasons': explainer.export_cache(),
+    }
+    size = checkpoint.save(state)
+    if size: log(f"💾 チェックポイント保存: {size / 1024:.1f}KB")
+
+def restore_checkpoint(today):
+    """当日のスケジューラを復元できればそれを返す (結果・解説キャッシュは日付に関係なく戻す)"""
+    state = checkpoint.load()
+    if not state: return None
+    scraper.import_results(state.get('results') or {})
+    explainer.import_cache(state.get('reasons') or [])
+    if state.get('date') != today or not state.get('scheduler'): return None
+    scheduler = RaceScheduler.restore(state['scheduler'])
+    log(f"♻️ チェックポイントから再開: 残り{scheduler.pending_count()}レース")
+    return scheduler
+
+def _on_sigterm(signum, frame):
+    raise KeyboardInterrupt
 
 def main():
     log("🚀 最強AI Bot (本番運用モード) 起動")
+    # Actions のキャンセル (SIGINT → SIGTERM) でも finally の停止処理を通す
+    signal.signal(signal.SIGTERM, _on_sigterm)
     init_db()
-    
-    stop_event = threading.Event()
-    t = threading.Thread(target=report_worker, args=(stop_event,), daemon=True)
-    t.start()
-    
+    db_writer.start_writer(DB_FILE)
+
     start_time = time.time()
     MAX_RUNTIME = 5.8 * 3600
 
-    while True:
-        now = datetime.datetime.now(JST)
-        # ミッドナイト終了時刻
-        if now.hour == 23 and now.minute >= 55:
-            log(f"🌙 {now.strftime('%H:%M')} ミッドナイト終了。")
-            break
-        # GitHub Actionsのタイムアウト対策
-        if time.time() - start_time > MAX_RUNTIME:
-            log("🔄 稼働時間上限。")
-            break
-
-        today = now.strftime('%Y%m%d')
-        log(f"⚡ Scan Start: {now.strftime('%H:%M:%S')}")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as ex:
-            for jcd in range(1, 25):
-                for rno in range(1, 13):
-                    ex.submit(process_race, jcd, rno, today)
-        
-        log("💤 休憩中...")
-        time.sleep(300)
+    stop_event = threading.Event()
+    scheduler = None
+    schedule_day = None
+    discovered = False      # 開催一覧の全会場の締切が揃ったか
+    discovered_at = 0.0
+    checkpoint_at = time.time()
+
+    try:
+        start_warmup()
+        explainer.start()
+        notifier.start_notifier()
+        t = threading.Thread(target=report_worker, args=(stop_event,), daemon=True)
+        t.start()
+
+        # 前のセッションの続きなら、予測済みレースの再取得を省く (開催情報は DB のキャッシュで足りない分だけ確認)
+        today = datetime.datetime.now(JST).strftime('%Y%m%d')
+        restored = restore_checkpoint(today)
+        if restored is not None:
+            scheduler, schedule_day = restored, today
+            load_notified(today)
+
+        while True:
+            now = datetime.datetime.now(JST)
+            # ミッドナイト終了時刻
+            if now.hour == 23 and now.minute >= 55:
+                log(f"🌙 {now.strftime('%H:%M')} ミッドナイト終了。")
+                break
+            # GitHub Actionsのタイムアウト対策
+            if time.time() - start_time > MAX_RUNTIME:
+                log("🔄 稼働時間上限。")
+                break
+
+            today = now.strftime('%Y%m%d')
+            if today != schedule_day:
+                scheduler = RaceScheduler()
+                schedule_day, discovered, discovered_at = today, False, 0.0
+                load_notified(today)
+            # 起動時・日付変更時に開催情報を確定 (未発表・取得失敗の会場があれば少し待って再確認)
+            if not discovered and time.time() - discovered_at > DISCOVERY_RETRY_SEC:
+                discovered = load_schedule(scheduler, today)
+                discovered_at = time.time()
+
+            targets = scheduler.due(now)
+            if targets:
+                log(f"⚡ Scan Start: {now.strftime('%H:%M:%S')} ({len(targets)}レース)")
+                t0 = time.perf_counter()
+                scan_cycle(targets, today, scheduler)
+                cycle_sec = time.perf_counter() - t0
+                metrics.observe('cycle', cycle_sec)
+                # サイクルごとの内訳を metrics/ に書き出す (Actions の artifact で実行間を比較)
+                summary = metrics.write_summary(cycle_sec, {'targets': len(targets), 'pending': scheduler.pending_count(),
+                                                              'hosts': scraper.host_stats(), 'page_cache': scraper.cache_stats()})
+                log(f"⏱️ Scan完了: {cycle_sec:.2f}秒 / " + " ".join(f"{k}={v['sum_sec']:.2f}s" for k, v in summary['stages'].items() if k in ('scrape', 'predict', 'record')))
+
+            if time.time() - checkpoint_at > checkpoint.CHECKPOINT_INTERVAL:
+                save_checkpoint(scheduler, schedule_day)
+                checkpoint_at = time.time()
 
-    stop_event.set()
+            # 次に取得窓へ入るレースまで待つ (日付変更・終了判定のため最大 SCAN_INTERVAL)
+            wake = scheduler.next_wakeup()
+            wait = SCAN_INTERVAL if wake is None else (wake - datetime.datetime.now(JST)).total_seconds()
+            time.sleep(min(max(wait, 1), SCAN_INTERVAL))
+    except KeyboardInterrupt:
+        log("🛑 停止要求を受信")
+    finally:
+        # 停止処理中に届く2回目のシグナル (Actions は SIGINT の後に SIGTERM) で中断されないようにする
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        stop_event.set()
+        # どれかが失敗しても書き込みスレッドは必ず止める (キューの残りを書き、WAL を DB 本体へ戻す)
+        for step in (lambda: save_checkpoint(scheduler, schedule_day), close_async,
+                     explainer.stop,  # 解説の追記が DB に書かれるよう、書き込みスレッドより先に止める
+                     notifier.stop_notifier):
+            try: step()
+            except Exception as e: log(f"⚠️ 停止処理エラー: {e}")
+        db_writer.stop_writer()
     log("👋 Bot停止")
 
 if __name__ == "__main__":
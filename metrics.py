@@ -0,0 +1,173 @@
+"""
+処理段階ごとの所要時間ヒストグラムとカウンタ (プロセス内で共有)
+
+  with metrics.timer('fetch', page='beforeinfo'): ...
+  metrics.observe('db_commit', sec)
+  metrics.inc('blocked_responses', page='racelist')
+
+main のスキャン1回ごとに write_summary() で metrics/ 以下へ書き出す:
+  metrics.json    … 累計 + 直近サイクルの差分 (人が見る用)
+  metrics.prom    … Prometheus テキスト形式 (node_exporter textfile collector 等でそのまま読める)
+  cycles.jsonl    … サイクルごとの差分を1行ずつ追記 (Actions の実行間で比較する用)
+"""
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+# ==========================================
+# ⚙️ メトリクス設定
+# ==========================================
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+# 秒。ページ取得 (数十ms〜数秒) と Groq / Discord (〜10秒) の両方を見られる幅
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_hist = {}      # (stage, labels) -> {'buckets': [...], 'count', 'sum', 'max'}
+_counters = {}  # (name, labels) -> int
+_state = {'cycle': 0, 'last': None, 'started': time.time()}
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(stage, seconds, **labels):
+    k = _key(stage, labels)
+    with _lock:
+        h = _hist.get(k)
+        if h is None:
+            h = _hist[k] = {'buckets': [0] * (len(BUCKETS) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0}
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]: i += 1
+        h['buckets'][i] += 1
+        h['count'] += 1
+        h['sum'] += seconds
+        if seconds > h['max']: h['max'] = seconds
+
+def inc(name, n=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + n
+
+@contextlib.contextmanager
+def timer(stage, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, **labels)
+
+def _label_str(labels):
+    return ",".join(f"{k}={v}" for k, v in labels)
+
+def _quantile(h, q):
+    # バケット上限で近似 (最大バケットを超えた分は最大値で代用)
+    if not h['count']: return 0.0
+    target, acc = q * h['count'], 0
+    for i, c in enumerate(h['buckets']):
+        acc += c
+        if acc >= target:
+            return min(BUCKETS[i], h['max']) if i < len(BUCKETS) else h['max']
+    return h['max']
+
+def snapshot():
+    with _lock:
+        hist = {k: {'buckets': list(h['buckets']), 'count': h['count'], 'sum': h['sum'], 'max': h['max']} for k, h in _hist.items()}
+        counters = dict(_counters)
+    return hist, counters
+
+def _stage_summary(hist):
+    out = {}
+    for (stage, labels), h in sorted(hist.items()):
+        if not h['count']: continue
+        name = stage + (f"{{{_label_str(labels)}}}" if labels else "")
+        out[name] = {
+            'count': h['count'],
+            'sum_sec': round(h['sum'], 4),
+            'avg_ms': round(h['sum'] / h['count'] * 1000, 2),
+            'p50_ms': round(_quantile(h, 0.5) * 1000, 2),
+            'p95_ms': round(_quantile(h, 0.95) * 1000, 2),
+        }
+    return out
+
+def _counter_summary(counters):
+    return {name + (f"{{{_label_str(labels)}}}" if labels else ""): v for (name, labels), v in sorted(counters.items()) if v}
+
+def _diff(cur, prev):
+    hist, counters = cur
+    if prev is None: return hist, counters
+    phist, pcounters = prev
+    dh = {}
+    for k, h in hist.items():
+        p = phist.get(k)
+        if p is None:
+            dh[k] = h
+        else:
+            dh[k] = {'buckets': [a - b for a, b in zip(h['buckets'], p['buckets'])],
+                     'count': h['count'] - p['count'], 'sum': h['sum'] - p['sum'], 'max': h['max']}
+    dc = {k: v - pcounters.get(k, 0) for k, v in counters.items()}
+    return dh, dc
+
+def to_prometheus(hist, counters, prefix="boatbot"):
+    """Prometheus テキスト形式 (ヒストグラムは _bucket / _sum / _count)"""
+    lines = []
+    by_stage = {}
+    for (stage, labels), h in sorted(hist.items()):
+        by_stage.setdefault(stage, []).append((labels, h))
+    for stage, series in by_stage.items():
+        metric = f"{prefix}_{stage}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, h in series:
+            base = ",".join(f'{k}="{v}"' for k, v in labels)
+            acc = 0
+            for i, c in enumerate(h['buckets']):
+                acc += c
+                le = repr(BUCKETS[i]) if i < len(BUCKETS) else "+Inf"
+                lines.append(f'{metric}_bucket{{{base + "," if base else ""}le="{le}"}} {acc}')
+            sel = f"{{{base}}}" if base else ""
+            lines.append(f"{metric}_sum{sel} {h['sum']:.6f}")
+            lines.append(f"{metric}_count{sel} {h['count']}")
+    by_name = {}
+    for (name, labels), v in sorted(counters.items()):
+        by_name.setdefault(name, []).append((labels, v))
+    for name, series in by_name.items():
+        metric = f"{prefix}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for labels, v in series:
+            base = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{base}}} {v}" if base else f"{metric} {v}")
+    return "\n".join(lines) + "\n"
+
+def _atomic_write(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def write_summary(cycle_sec=None, extra=None):
+    """スキャン1回分の差分と累計をファイルに書き出し、差分のサマリー dict を返す"""
+    cur = snapshot()
+    with _lock:
+        prev = _state['last']
+        _state['last'] = cur
+        _state['cycle'] += 1
+        cycle = _state['cycle']
+    dh, dc = _diff(cur, prev)
+
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    delta = {'time': now, 'cycle': cycle, 'cycle_sec': round(cycle_sec, 3) if cycle_sec is not None else None,
+             'stages': _stage_summary(dh), 'counters': _counter_summary(dc)}
+    if extra: delta.update(extra)
+
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        report = {'updated': now, 'uptime_sec': round(time.time() - _state['started'], 1), 'cycles': cycle,
+                  'last_cycle': delta, 'total': {'stages': _stage_summary(cur[0]), 'counters': _counter_summary(cur[1])}}
+        _atomic_write(os.path.join(METRICS_DIR, "metrics.json"), json.dumps(report, ensure_ascii=False, indent=2))
+        _atomic_write(os.path.join(METRICS_DIR, "metrics.prom"), to_prometheus(*cur))
+        with open(os.path.join(METRICS_DIR, "cycles.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(delta, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ メトリクス書き出し失敗: {e}", flush=True)
+    return delta
@@ -0,0 +1,186 @@
+"""
+Discord Webhook 送信をまとめて行うバックグラウンドスレッド
+
+send() はキューに積んで即戻る (スキャン・結果確認のスレッドを止めない)。
+送信スレッドは COALESCE_SEC の間に届いたメッセージを 2000 文字以内の1投稿にまとめ、
+429 では retry_after / Retry-After だけ待って同じ投稿を再送する。
+X-RateLimit-Remaining が 0 なら、429 を食らう前に Reset-After まで待つ。
+"""
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import metrics
+
+# ==========================================
+# ⚙️ 通知設定
+# ==========================================
+COALESCE_SEC = 1.5      # 最初の1件からこの秒数以内に来たものを1投稿にまとめる
+MAX_CONTENT = 2000      # Discord の content 上限
+SEPARATOR = "\n━━━━━━━━━━\n"
+QUEUE_SIZE = 1000
+MAX_ATTEMPTS = 5        # 5xx / 接続エラー時の最大試行回数 (429 は数えない)
+MAX_RATE_LIMITED = 20   # 429 が続く場合の上限 (無限ループ防止)
+BACKOFF_BASE = 1.0
+TIMEOUT = 10
+
+def webhook_url():
+    return os.environ.get("DISCORD_WEBHOOK_URL")
+
+def pack(messages, limit=MAX_CONTENT):
+    """メッセージを区切り線でつなぎ、limit 文字以内の投稿に詰める (1件で超えるものは分割)"""
+    posts, cur = [], ""
+    for msg in messages:
+        while len(msg) > limit:
+            if cur: posts.append(cur); cur = ""
+            posts.append(msg[:limit])
+            msg = msg[limit:]
+        if not cur:
+            cur = msg
+        elif len(cur) + len(SEPARATOR) + len(msg) <= limit:
+            cur += SEPARATOR + msg
+        else:
+            posts.append(cur)
+            cur = msg
+    if cur: posts.append(cur)
+    return posts
+
+def _retry_after(resp):
+    try:
+        return float(resp.json().get("retry_after"))
+    except Exception:
+        pass
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except Exception:
+        return 1.0
+
+class Notifier(threading.Thread):
+    def __init__(self, url=None):
+        super().__init__(name="discord-notifier", daemon=True)
+        self.url = url
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._session = requests.Session()
+        self._blocked_until = 0.0   # バケット枯渇時、次に投稿してよい時刻
+        self.stats = {'messages': 0, 'posts': 0, 'rate_limited': 0, 'failed': 0, 'dropped': 0}
+
+    def submit(self, content):
+        try:
+            self._queue.put_nowait(content)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            print("💀 Discord送信キュー満杯: メッセージ破棄", flush=True)
+
+    def close(self, timeout=30):
+        self._queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None: break
+            batch = [first]
+            # まとめる時間 (停止要求が来たら待たずに送る)
+            end = time.monotonic() + COALESCE_SEC
+            while True:
+                remain = end - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remain) if remain > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    end = 0
+                    continue
+                batch.append(item)
+            self._deliver(batch)
+
+        # 停止後に残ったものも送る
+        rest = []
+        while True:
+            try: item = self._queue.get_nowait()
+            except queue.Empty: break
+            if item is not None: rest.append(item)
+        if rest: self._deliver(rest)
+
+    def _deliver(self, messages):
+        url = self.url or webhook_url()
+        if not url: return
+        posts = pack(messages)
+        for content in posts:
+            if self._post(url, content):
+                self.stats['posts'] += 1
+            else:
+                self.stats['failed'] += 1
+        self.stats['messages'] += len(messages)
+        print(f"✅ Discord送信: {len(messages)}件 → {len(posts)}投稿", flush=True)
+
+    def _post(self, url, content):
+        attempts = limited = 0
+        while attempts < MAX_ATTEMPTS and limited < MAX_RATE_LIMITED:
+            wait = self._blocked_until - time.monotonic()
+            if wait > 0: time.sleep(wait)
+            try:
+                with metrics.timer('discord'):
+                    resp = self._session.post(url, json={"content": content}, timeout=TIMEOUT)
+                metrics.inc('discord_requests', status=resp.status_code)
+            except Exception as e:
+                attempts += 1
+                print(f"💀 Discord接続エラー ({attempts}/{MAX_ATTEMPTS}): {e}", flush=True)
+                time.sleep(BACKOFF_BASE * 2 ** (attempts - 1))
+                continue
+
+            # 残り0なら次の投稿はリセットまで待つ
+            if resp.headers.get("X-RateLimit-Remaining") == "0":
+                try: self._blocked_until = time.monotonic() + float(resp.headers.get("X-RateLimit-Reset-After", 0))
+                except: pass
+
+            if 200 <= resp.status_code < 300:
+                return True
+            if resp.status_code == 429:
+                limited += 1
+                self.stats['rate_limited'] += 1
+                self._blocked_until = time.monotonic() + _retry_after(resp)
+                continue
+            if resp.status_code >= 500:
+                attempts += 1
+                time.sleep(BACKOFF_BASE * 2 ** (attempts - 1))
+                continue
+            print(f"💀 Discord送信失敗: Code {resp.status_code}", flush=True)
+            return False
+        print("💀 Discord送信失敗: リトライ上限", flush=True)
+        return False
+
+# ==========================================
+# プロセス内で共有する送信スレッド
+# ==========================================
+_notifier = None
+
+def start_notifier(url=None):
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(url)
+        _notifier.start()
+    return _notifier
+
+def stop_notifier(timeout=30):
+    """キューに残ったメッセージを送り切ってから止める"""
+    global _notifier
+    if _notifier is not None:
+        _notifier.close(timeout)
+        s = _notifier.stats
+        print(f"📨 Discord: {s['messages']}件 / {s['posts']}投稿 / 429 {s['rate_limited']}回 / 失敗 {s['failed']} / 破棄 {s['dropped']}", flush=True)
+        _notifier = None
+
+def send(content):
+    """送信スレッドがあれば積んで即戻る。無ければ (スクリプト実行時など) その場で送る"""
+    if _notifier is not None:
+        if _notifier.url or webhook_url(): _notifier.submit(content)
+        return
+    url = webhook_url()
+    if not url: return
+    Notifier(url)._post(url, content)
@@ -3,85 +3,222 @@ import numpy as np
 import lightgbm as lgb
 import joblib
 import os
-import requests
 import time
 import json
 import traceback
+import hashlib
+import threading
+import pickle
+
+import harville
+import metrics
 
 MODEL_FILE = 'ultimate_boat_model.pkl'
 STRATEGY_FILE = 'ultimate_winning_strategies.csv'
+# CSVをコンパイルした索引のキャッシュ (CSVの更新日時・サイズ・閾値が一致する間だけ有効)
+STRATEGY_INDEX_FILE = 'ultimate_winning_strategies.idx.pkl'
 
 # ==========================================
 # ⚙️ 本番運用設定
 # ==========================================
 MIN_PROFIT = 1000   
 MIN_ROI = 110       
+MIN_BETS = 30       # 集計期間の購入数がこれ未満の買い目は、たまたまの的中で回収率が跳ねるので採用しない
+
+# モデルの更新チェック間隔(秒)。この間隔内はディスクに一切触れない
+MODEL_CHECK_INTERVAL = 60
+
+# 券種ごとに、モデル確率の上位何点までを候補にするか (候補は全買い目の配列演算で一度に絞る)
+# train_model.strategy_table も同じ上位 TOP_COMBOS 点で成績を集計する (変えたら戦略テーブルを作り直す)
+TOP_COMBOS = 3
+# 券種ごとの推奨数 (候補のうち期待値 = モデル確率 × オッズ の高い順。オッズが無いレースは確率順)
+PICKS_PER_TYPE = 1
+# オッズが取れたレースでは、期待値がこれ未満の買い目は推奨しない (1.0 = 払戻と購入額が釣り合う)
+MIN_EV = 1.1
+
+# LightGBM 推論のスレッド数 (1レースの推論はスレッドを増やしても速くならない)
+PREDICT_THREADS = 1
+
+# ==========================================
+# 🧠 モデルレジストリ (プロセス内で1回だけロードして共有)
+# ==========================================
+_model_lock = threading.Lock()
+_model_state = {
+    'models': None,     # joblib.load の結果 (読み取り専用で共有)
+    'mtime': None,
+    'hash': None,
+    'checked_at': 0.0,
+    'load_sec': 0.0,
+    'mem_mb': 0.0,
+}
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _rss_mb():
+    # Linux (GitHub Actions) のみ。取れない環境では 0
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+def _load_models_locked(mtime):
+    file_hash = _file_hash(MODEL_FILE)
+    if _model_state['models'] is not None and file_hash == _model_state['hash']:
+        # 更新日時だけ変わって中身は同じ → 再ロード不要
+        _model_state['mtime'] = mtime
+        return
+
+    rss_before = _rss_mb()
+    t0 = time.perf_counter()
+    models = joblib.load(MODEL_FILE)
+    load_sec = time.perf_counter() - t0
+    metrics.observe('model_load', load_sec)
+    mem_mb = max(_rss_mb() - rss_before, 0.0)
+
+    reloaded = _model_state['models'] is not None
+    _model_state.update({
+        'models': models,
+        'mtime': mtime,
+        'hash': file_hash,
+        'load_sec': load_sec,
+        'mem_mb': mem_mb,
+    })
+    size_mb = os.path.getsize(MODEL_FILE) / (1024 * 1024)
+    label = "再ロード" if reloaded else "ロード"
+    print(f"🧠 モデル{label}完了: {load_sec:.2f}秒 / ファイル {size_mb:.1f}MB / メモリ +{mem_mb:.1f}MB (hash:{file_hash[:8]})", flush=True)
+
+def get_models():
+    """共有モデルを返す。MODEL_CHECK_INTERVAL ごとに更新日時を見て、変わっていればハッシュ比較の上で再ロード"""
+    now = time.time()
+    if _model_state['models'] is not None and now - _model_state['checked_at'] < MODEL_CHECK_INTERVAL:
+        return _model_state['models']
 
-# Groq設定
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
-
-def ask_groq_reason(row, combo, ptype):
-    # ★修正: APIキーの前後の空白・改行を削除してクリーンにする
-    api_key = os.environ.get("GROQ_API_KEY", "").strip()
-    
-    print(f"🤖 Groq API呼び出し(requests): {combo}...", flush=True)
-    
-    if not api_key: 
-        print("❌ Groq Error: APIキーなし", flush=True)
-        return "AI解説: (APIキー設定なし)"
-    
-    def safe_get(key):
+    with _model_lock:
+        if _model_state['models'] is not None and now - _model_state['checked_at'] < MODEL_CHECK_INTERVAL:
+            return _model_state['models']
         try:
-            val = row.get(key, 0)
-            if isinstance(val, (list, np.ndarray)):
-                return val[0] if len(val) > 0 else 0
-            return val
-        except:
-            return 0
-        
-    data_str = (
-        f"1号艇:勝率{safe_get('wr1')}\n"
-        f"2号艇:勝率{safe_get('wr2')}\n"
-        f"3号艇:勝率{safe_get('wr3')}\n"
-        f"4号艇:勝率{safe_get('wr4')}\n"
-    )
-    prompt = f"買い目「{combo}」({ptype})を推奨する理由を、競艇のプロとして100文字以内で断言せよ。\nデータ:\n{data_str}"
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": GROQ_MODEL,
-        "messages": [
-            {"role": "system", "content": "You are a professional boat race analyst. Answer in Japanese."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 150
+            mtime = os.path.getmtime(MODEL_FILE)
+        except OSError:
+            # ファイルが消えていても、ロード済みならそのまま使い続ける
+            _model_state['checked_at'] = now
+            return _model_state['models']
+
+        if _model_state['models'] is None or mtime != _model_state['mtime']:
+            try:
+                _load_models_locked(mtime)
+            except Exception as e:
+                print(f"⚠️ モデルロード失敗: {e}", flush=True)
+        _model_state['checked_at'] = now
+        return _model_state['models']
+
+def warmup_models():
+    """Bot起動時に呼び、最初のレースでロード待ちが発生しないようにする (戦略索引も同時に準備)"""
+    models = get_models()
+    if models is None:
+        print(f"⚠️ モデルファイルなし: {MODEL_FILE}", flush=True)
+    get_strategy_index()
+    return model_stats()
+
+def model_stats():
+    return {
+        'loaded': _model_state['models'] is not None,
+        'hash': _model_state['hash'],
+        'load_sec': round(_model_state['load_sec'], 3),
+        'mem_mb': round(_model_state['mem_mb'], 1),
     }
 
-    # リトライ処理
-    for attempt in range(3):
+# ==========================================
+# 📋 戦略テーブル索引 ((券種, 買い目) → 成績 を O(1) で引く)
+# ==========================================
+_strategy_lock = threading.Lock()
+_strategy_state = {
+    'index': None,      # {(券種, 買い目): {'profit', 'prob', 'roi'}} ※閾値を満たすものだけ
+    'src_key': None,    # (mtime, size) でCSVの更新を検知
+    'checked_at': 0.0,
+    'vectors': None,    # strategy_vectors() の結果 (index が差し替わったら作り直す)
+    'vectors_src': None,
+}
+
+def _compile_strategies():
+    df = pd.read_csv(STRATEGY_FILE)
+    # 同じ買い目が複数行ある場合は従来通り先頭行を採用
+    df = df.drop_duplicates(subset=['券種', '買い目'], keep='first')
+    df = df[(df['収支'] >= MIN_PROFIT) & (df['回収率'] >= MIN_ROI)]
+    if '購入数' in df:
+        df = df[df['購入数'] >= MIN_BETS]
+    index = {}
+    for ptype, combo, profit, prob, roi in zip(df['券種'], df['買い目'], df['収支'], df['的中率'], df['回収率']):
+        index[(str(ptype), str(combo))] = {'profit': int(profit), 'prob': float(prob), 'roi': float(roi)}
+    return index
+
+def _load_strategy_index(src_key):
+    sidecar_key = (src_key, MIN_PROFIT, MIN_ROI, MIN_BETS)
+    try:
+        with open(STRATEGY_INDEX_FILE, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('key') == sidecar_key:
+            return cached['index']
+    except Exception:
+        pass
+
+    index = _compile_strategies()
+    try:
+        tmp = STRATEGY_INDEX_FILE + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'key': sidecar_key, 'index': index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, STRATEGY_INDEX_FILE)
+    except Exception as e:
+        print(f"⚠️ 戦略索引の保存失敗: {e}", flush=True)
+    print(f"📋 戦略テーブル索引を作成: {len(index)}件 (収支>={MIN_PROFIT}, 回収率>={MIN_ROI}, 購入数>={MIN_BETS})", flush=True)
+    return index
+
+def get_strategy_index():
+    now = time.time()
+    if _strategy_state['index'] is not None and now - _strategy_state['checked_at'] < MODEL_CHECK_INTERVAL:
+        return _strategy_state['index']
+
+    with _strategy_lock:
+        if _strategy_state['index'] is not None and now - _strategy_state['checked_at'] < MODEL_CHECK_INTERVAL:
+            return _strategy_state['index']
         try:
-            response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                content = data['choices'][0]['message']['content']
-                print(f"🤖 Groq応答成功", flush=True)
-                return content
-            else:
-                print(f"⚠️ Groq API Error {response.status_code}: {response.text}", flush=True)
-                time.sleep(2)
-                
-        except Exception as e:
-            print(f"⚠️ Groq Connection Error (Attempt {attempt+1}): {e}", flush=True)
-            time.sleep(2)
+            st = os.stat(STRATEGY_FILE)
+            src_key = (st.st_mtime, st.st_size)
+        except OSError:
+            _strategy_state['checked_at'] = now
+            return _strategy_state['index']
+
+        if _strategy_state['index'] is None or src_key != _strategy_state['src_key']:
+            try:
+                _strategy_state['index'] = _load_strategy_index(src_key)
+                _strategy_state['src_key'] = src_key
+            except Exception as e:
+                print(f"⚠️ 戦略テーブル読込失敗: {e}", flush=True)
+        _strategy_state['checked_at'] = now
+        return _strategy_state['index']
 
-    return "AI解説: (通信エラー)"
+def strategy_vectors():
+    """戦略索引を harville の買い目の並びに揃えた配列 {券種: {'profit', 'prob', 'roi'}} (不採用は NaN)"""
+    index = get_strategy_index()
+    with _strategy_lock:
+        if _strategy_state['vectors'] is None or _strategy_state['vectors_src'] is not index:
+            vectors = {}
+            for ptype, combos in (('3連単', harville.TRIFECTA_COMBOS), ('2連単', harville.EXACTA_COMBOS)):
+                cols = {k: np.full(len(combos), np.nan) for k in ('profit', 'prob', 'roi')}
+                for i, combo in enumerate(combos):
+                    hit = (index or {}).get((ptype, combo))
+                    if hit:
+                        for k in cols: cols[k][i] = hit[k]
+                vectors[ptype] = cols
+            _strategy_state['vectors'] = vectors
+            _strategy_state['vectors_src'] = index
+        return _strategy_state['vectors']
 
 # 再帰的クリーニング
 def unwrap_value(v):
@@ -98,154 +235,275 @@ def unwrap_value(v):
     except:
         return 0.0
 
-def predict_race(raw_data):
-    recommendations = []
-    
-    clean_data = {}
-    for k, v in raw_data.items():
-        clean_data[k] = unwrap_value(v)
-            
-    try:
-        if not os.path.exists(MODEL_FILE):
-            return []
-
-        models = joblib.load(MODEL_FILE)
-        
-        if 'features' in models:
-            required_feats = models['features']
-        else:
-            return []
-
-        df = pd.DataFrame([clean_data])
-        
+# 艇ごとの基本特徴量。ex/st は「小さいほど良い」ので rel の符号を反転する
+BOAT_FEATS = ('wr', 'mo', 'ex', 'st')
+REVERSED_REL = ('ex', 'st')
+
+def _assemble_features(get_col, n, required_feats):
+    """get_col(列名) → 長さ n の float64 配列 から (n, 特徴量数) の float32 行列を作る (推論・学習で共通)"""
+    # 艇ごとの基本値 → (n, 6) の配列にまとめて mean / rel をまとめて計算
+    columns = {}
+    for p in BOAT_FEATS:
+        block = np.column_stack([get_col(f'{p}{i}') for i in range(1, 7)]).reshape(n, 6)
+        mean = block.mean(axis=1)
+        rel = (mean[:, None] - block) if p in REVERSED_REL else (block - mean[:, None])
+        columns[f'{p}_mean'] = mean
         for i in range(1, 7):
-            if f'wr{i}' not in df.columns: df[f'wr{i}'] = 0.0
-            if f'mo{i}' not in df.columns: df[f'mo{i}'] = 0.0
-            if f'ex{i}' not in df.columns: df[f'ex{i}'] = 0.0
-            if f'st{i}' not in df.columns: df[f'st{i}'] = 0.0
+            columns[f'{p}{i}'] = block[:, i - 1]
+            columns[f'{p}{i}_rel'] = rel[:, i - 1]
 
-        df['wr_mean'] = df[[f'wr{i}' for i in range(1, 7)]].mean(axis=1)
-        df['mo_mean'] = df[[f'mo{i}' for i in range(1, 7)]].mean(axis=1)
-        df['ex_mean'] = df[[f'ex{i}' for i in range(1, 7)]].mean(axis=1)
-        df['st_mean'] = df[[f'st{i}' for i in range(1, 7)]].mean(axis=1)
+    if not required_feats:
+        return np.zeros((n, 0), dtype=np.float32)
+    # その他の生データ列 (無い列は 0.0)
+    return np.column_stack([columns[f] if f in columns else get_col(f) for f in required_feats]).astype(np.float32)
 
-        for i in range(1, 7):
-            df[f'wr{i}_rel'] = df[f'wr{i}'] - df['wr_mean']
-            df[f'mo{i}_rel'] = df[f'mo{i}'] - df['mo_mean']
-            df[f'ex{i}_rel'] = df['ex_mean'] - df[f'ex{i}'] 
-            df[f'st{i}_rel'] = df['st_mean'] - df[f'st{i}'] 
-        
-        df_final = pd.DataFrame()
-        for f in required_feats:
-            if f in df.columns:
-                df_final[f] = df[f]
+def build_feature_matrix(clean_rows, required_feats):
+    """クリーニング済みの行dictのリストから (レース数, 特徴量数) の float32 行列を一括生成"""
+    return _assemble_features(
+        lambda f: np.array([r.get(f, 0.0) for r in clean_rows], dtype=np.float64),
+        len(clean_rows), required_feats)
+
+def build_feature_frame(df, required_feats):
+    """DataFrame (race_features / 学習CSV) から build_feature_matrix と同じ行列を作る。欠損は 0.0"""
+    def get_col(f):
+        if f not in df: return np.zeros(len(df), dtype=np.float64)
+        return pd.to_numeric(df[f], errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+    return _assemble_features(get_col, len(df), required_feats)
+
+def predict_class_idx(model, X):
+    """各行の予測艇インデックス (0〜5) を返す。predict_proba が無いモデルにも対応"""
+    try:
+        proba = model.predict_proba(X)
+        return np.argmax(proba, axis=1)
+    except:
+        pass
+
+    pred = model.predict(X)
+    if hasattr(pred, 'ndim') and pred.ndim == 2 and pred.shape[1] > 1:
+        return np.argmax(pred, axis=1)
+
+    out = []
+    for val in pred:
+        if hasattr(val, 'ndim') and val.ndim > 0:
+            if val.size == 1:
+                val = val.item()
             else:
-                df_final[f] = 0.0
-        
-        X = df_final.values.astype(np.float32)
-        
-        try:
-            def safe_predict_idx(model, input_x):
                 try:
-                    proba = model.predict_proba(input_x)
-                    return np.argmax(proba, axis=1)[0]
+                    out.append(int(np.argmax(val)))
+                    continue
                 except:
-                    pass
-                
-                pred = model.predict(input_x)
-                if hasattr(pred, 'ndim') and pred.ndim == 2 and pred.shape[1] > 1:
-                    return np.argmax(pred, axis=1)[0]
-                
-                val = pred[0]
-                if hasattr(val, 'ndim') and val.ndim > 0:
-                    if val.size == 1:
-                        val = val.item()
-                    else:
-                        try: return np.argmax(val)
-                        except: val = val[0]
-                elif isinstance(val, (list, tuple)) and len(val) > 1:
-                     val = val[0]
-                return int(val) - 1
-
-            p1_idx = safe_predict_idx(models['r1'], X)
-            p2_idx = safe_predict_idx(models['r2'], X)
-            p3_idx = safe_predict_idx(models['r3'], X)
+                    val = val[0]
+        elif isinstance(val, (list, tuple)) and len(val) > 1:
+            val = val[0]
+        out.append(int(val) - 1)
+    return np.array(out, dtype=int)
 
+def _booster_of(model):
+    """LightGBM の Booster (sklearn ラッパーなら中身) を返す。LightGBM 以外は None"""
+    if isinstance(model, lgb.Booster): return model
+    booster = getattr(model, 'booster_', None)
+    return booster if isinstance(booster, lgb.Booster) else None
+
+def predict_proba_matrix(model, X):
+    """各行の6艇の確率 (n, 6)。確率を出せないモデルは予測艇だけ 1 の one-hot"""
+    booster = _booster_of(model)
+    if booster is not None:
+        return booster.predict(X, num_threads=PREDICT_THREADS)
+    try:
+        return np.asarray(model.predict_proba(X), dtype=np.float64)
+    except:
+        pass
+    pred = model.predict(X)
+    if hasattr(pred, 'ndim') and pred.ndim == 2 and pred.shape[1] == 6:
+        return np.asarray(pred, dtype=np.float64)
+    onehot = np.zeros((len(X), 6))
+    onehot[np.arange(len(X)), np.clip(predict_class_idx(model, X), 0, 5)] = 1.0
+    return onehot
+
+def predict_combo_probs(raw_rows):
+    """(3連単確率 (n, 120), 2連単確率 (n, 30)) を返す。並びは harville.TRIFECTA_COMBOS / EXACTA_COMBOS
+    モデルが無い・推論に失敗した場合は None"""
+    if not raw_rows:
+        return None
+    clean_rows = [{k: unwrap_value(v) for k, v in raw.items()} for raw in raw_rows]
+    try:
+        models = get_models()
+        if models is None or 'features' not in models:
+            return None
+
+        with metrics.timer('features'):
+            X = build_feature_matrix(clean_rows, models['features'])
+
+        try:
+            with metrics.timer('inference'):
+                P1, P2, P3 = (predict_proba_matrix(models[k], X) for k in ('r1', 'r2', 'r3'))
         except Exception as inner_e:
             print(f"⚠️ Internal Predict Error: {inner_e}")
-            return []
+            return None
 
-        p1, p2, p3 = p1_idx + 1, p2_idx + 1, p3_idx + 1
-        
+        with metrics.timer('combo_probs'):
+            return harville.combo_probs(P1, P2, P3)
     except Exception as e:
         print(f"⚠️ AI Prediction Error: {e}", flush=True)
-        return [] 
+        return None
 
-    form_3t = f"{p1}-{p2}-{p3}"
-    form_2t = f"{p1}-{p2}"
-    
-    strategies = None
-    try:
-        if os.path.exists(STRATEGY_FILE):
-            strategies = pd.read_csv(STRATEGY_FILE)
-    except: pass
-
-    # ★ 3連単
-    if p1 != p2 and p1 != p3 and p2 != p3:
-        profit, prob, roi = 0, 0, 0
-        valid = False
-        
-        if strategies is not None:
-            match = strategies[(strategies['券種'] == '3連単') & (strategies['買い目'] == form_3t)]
-            if not match.empty:
-                profit = int(match.iloc[0]['収支'])
-                prob = match.iloc[0]['的中率']
-                roi = match.iloc[0]['回収率']
-                
-                if profit >= MIN_PROFIT and roi >= MIN_ROI:
-                    valid = True
-                    print(f"✅ 採用: 3連単 {form_3t} (期待値:{profit}円)", flush=True)
-                else:
-                    print(f"🛑 却下: 3連単 {form_3t} (期待値:{profit}円)", flush=True)
-        
-        if valid:
-            reason = ask_groq_reason(clean_data, form_3t, "3連単")
-            recommendations.append({
-                'type': '3連単',
-                'combo': form_3t,
-                'prob': prob,
-                'profit': profit,
-                'roi': roi,
-                'reason': reason
-            })
-
-    # ★ 2連単
-    if p1 != p2:
-        profit, prob, roi = 0, 0, 0
-        valid = False
-        
-        if strategies is not None:
-            match = strategies[(strategies['券種'] == '2連単') & (strategies['買い目'] == form_2t)]
-            if not match.empty:
-                profit = int(match.iloc[0]['収支'])
-                prob = match.iloc[0]['的中率']
-                roi = match.iloc[0]['回収率']
-                
-                if profit >= MIN_PROFIT and roi >= MIN_ROI:
-                    valid = True
-                    print(f"✅ 採用: 2連単 {form_2t} (期待値:{profit}円)", flush=True)
-                else:
-                    print(f"🛑 却下: 2連単 {form_2t} (期待値:{profit}円)", flush=True)
-        
-        if valid:
-            reason = ask_groq_reason(clean_data, form_2t, "2連単")
-            recommendations.append({
-                'type': '2連単',
-                'combo': form_2t,
-                'prob': prob,
-                'profit': profit,
-                'roi': roi,
-                'reason': reason
-            })
-            
+def odds_matrix(snaps, key, width):
+    """scraper.scrape_odds のスナップショットのリスト → (n, width) のオッズ配列 (未取得は NaN)"""
+    out = np.full((len(snaps), width), np.nan)
+    for r, snap in enumerate(snaps):
+        if snap is not None and snap.get(key) is not None:
+            out[r] = snap[key]
+    return out
+
+def _select(probs, odds, vec):
+    """全レース × 全買い目の (確率, オッズ, 戦略) から採用する列番号を選ぶ
+    戻り値: 列番号 (n, PICKS_PER_TYPE) (採用なしは -1), 期待値 (n, 買い目数) (オッズ未取得は NaN)"""
+    k = min(TOP_COMBOS, probs.shape[1])
+    ev = probs * odds
+    # 確率の順位 (0 = 最有力) が TOP_COMBOS 未満で、戦略テーブルで採用されている買い目が候補
+    rank = np.argsort(np.argsort(-probs, axis=1, kind='stable'), axis=1, kind='stable')
+    ok = (rank < k) & ~np.isnan(vec['profit'])[None, :]
+    # 分布が全て 0 のレース (確率を出せないモデルで1着・2着の予測艇が重なった等) は推奨しない
+    ok &= probs.sum(axis=1, keepdims=True) > 0
+    # オッズがあるレースは期待値で絞って期待値順、無いレースは確率順
+    has_odds = ~np.isnan(odds).all(axis=1, keepdims=True)
+    ok &= ~has_odds | (np.nan_to_num(ev, nan=-1.0) >= MIN_EV)
+    score = np.where(ok, np.where(has_odds, ev, probs), -np.inf)
+    order = np.argsort(-score, axis=1, kind='stable')[:, :PICKS_PER_TYPE]
+    return np.where(np.take_along_axis(ok, order, axis=1), order, -1), ev
+
+def _recommend(ptype, combos, cols, probs, odds, ev, vec):
+    """_select で選ばれた列 (cols) を推奨 dict にする"""
+    recommendations = []
+    for c in cols:
+        if c < 0: continue
+        combo, profit = combos[c], int(vec['profit'][c])
+        o, e = (None, None) if np.isnan(odds[c]) else (float(odds[c]), round(float(ev[c]), 3))
+        print(f"✅ 採用: {ptype} {combo} (期待値:{profit}円" + (f" / EV {e:.2f}" if e is not None else "") + ")", flush=True)
+        recommendations.append({
+            'type': ptype,
+            'combo': combo,
+            'prob': float(vec['prob'][c]),
+            'profit': profit,
+            'roi': float(vec['roi'][c]),
+            'model_prob': round(float(probs[c]) * 100, 2),  # 着順モデルから計算した的中確率 (%)
+            'odds': o,
+            'ev': e,    # モデル確率 × オッズ (1円あたりの払戻期待値)
+        })
     return recommendations
+
+def _recommend_all(tri, exa, snaps=None):
+    """(n, 120) / (n, 30) の確率と各レースのオッズスナップショットから推奨リストを作る"""
+    vectors = strategy_vectors()
+    snaps = snaps if snaps is not None else [None] * tri.shape[0]
+    odds3 = odds_matrix(snaps, 'trifecta', tri.shape[1])
+    odds2 = odds_matrix(snaps, 'exacta', exa.shape[1])
+
+    # 全レース × 全買い目の期待値・戦略照合を一度に計算
+    cols3, ev3 = _select(tri, odds3, vectors['3連単'])
+    cols2, ev2 = _select(exa, odds2, vectors['2連単'])
+
+    results = []
+    for r in range(tri.shape[0]):
+        try:
+            recs = _recommend('3連単', harville.TRIFECTA_COMBOS, cols3[r], tri[r], odds3[r], ev3[r], vectors['3連単'])
+            recs += _recommend('2連単', harville.EXACTA_COMBOS, cols2[r], exa[r], odds2[r], ev2[r], vectors['2連単'])
+            results.append(recs)
+        except Exception as e:
+            print(f"⚠️ Recommend Error: {e}", flush=True)
+            results.append([])
+    return results
+
+def predict_races(raw_rows, snaps=None):
+    """1スキャン分のレースをまとめて推論し、raw_rows と同じ順で推奨リストのリストを返す
+    snaps は raw_rows と同じ順のオッズスナップショット (None 可)。あれば期待値で買い目を選ぶ"""
+    if not raw_rows:
+        return []
+    dist = predict_combo_probs(raw_rows)
+    if dist is None:
+        return [[] for _ in raw_rows]
+    return _recommend_all(*dist, snaps)
+
+# ==========================================
+# ⚡ 1レース用の高速経路 (特徴量の並びを事前に解決し、固定バッファへ直接書き込む)
+# ==========================================
+class FeaturePlan:
+    """models['features'] を1回だけ解析した「どの列に何を書くか」の表
+
+    fill(raw) は生の行dictから必要なキーだけを読み、(1, 特徴量数) の float32 バッファを埋める。
+    build_feature_matrix と同じ値になる (DataFrame も中間配列も作らない)。"""
+
+    def __init__(self, features):
+        self.features = list(features)
+        self.n = len(self.features)
+        index = {f: j for j, f in enumerate(self.features)}
+        # 艇ごとの値・相対値・平均のうち、モデルが使う列だけを (列番号, 艇番号) で持つ
+        self.boat = {}
+        derived = set()
+        for p in BOAT_FEATS:
+            val = [(index[f'{p}{i}'], i - 1) for i in range(1, 7) if f'{p}{i}' in index]
+            rel = [(index[f'{p}{i}_rel'], i - 1) for i in range(1, 7) if f'{p}{i}_rel' in index]
+            mean = index.get(f'{p}_mean')
+            if val or rel or mean is not None:
+                self.boat[p] = (val, rel, mean, p in REVERSED_REL)
+            derived.update([f'{p}{i}' for i in range(1, 7)] + [f'{p}{i}_rel' for i in range(1, 7)] + [f'{p}_mean'])
+        self.raw = [(j, f) for j, f in enumerate(self.features) if f not in derived]
+        self._local = threading.local()
+
+    def buffer(self):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            buf = self._local.buf = np.zeros((1, self.n), dtype=np.float32)
+        return buf
+
+    def fill(self, raw):
+        buf = self.buffer()
+        out = buf[0]
+        for j, f in self.raw:
+            out[j] = unwrap_value(raw.get(f, 0.0))
+        for p, (val, rel, mean, reverse) in self.boat.items():
+            v = [unwrap_value(raw.get(f'{p}{i}', 0.0)) for i in range(1, 7)]
+            m = sum(v) / 6.0
+            for j, i in val: out[j] = v[i]
+            for j, i in rel: out[j] = (m - v[i]) if reverse else (v[i] - m)
+            if mean is not None: out[mean] = m
+        return buf
+
+_plan_state = {'models': None, 'plan': None, 'boosters': None}
+_plan_lock = threading.Lock()
+
+def _compiled(models):
+    """モデルごとの FeaturePlan と Booster を (モデル再ロード時だけ) 作り直して返す"""
+    if _plan_state['models'] is not models:
+        with _plan_lock:
+            if _plan_state['models'] is not models:
+                boosters = tuple(_booster_of(models[k]) for k in ('r1', 'r2', 'r3'))
+                _plan_state.update({'plan': FeaturePlan(models['features']),
+                                    'boosters': boosters if all(b is not None for b in boosters) else None,
+                                    'models': models})
+    return _plan_state['plan'], _plan_state['boosters']
+
+def single_combo_probs(raw_data):
+    """1レース分の (3連単確率 (1, 120), 2連単確率 (1, 30))。LightGBM 以外のモデルは一括経路で計算"""
+    models = get_models()
+    if models is None or 'features' not in models:
+        return None
+    plan, boosters = _compiled(models)
+    if boosters is None:
+        return predict_combo_probs([raw_data])
+
+    with metrics.timer('inference_single'):
+        X = plan.fill(raw_data)
+        P1, P2, P3 = (b.predict(X, num_threads=PREDICT_THREADS) for b in boosters)
+        return harville.combo_probs(P1, P2, P3)
+
+def predict_race(raw_data, snap=None):
+    """1レースだけの推論 (特徴量プラン + Booster 直呼び)"""
+    try:
+        dist = single_combo_probs(raw_data)
+    except Exception as e:
+        print(f"⚠️ AI Prediction Error: {e}", flush=True)
+        return []
+    if dist is None:
+        return []
+    return _recommend_all(*dist, [snap])[0]
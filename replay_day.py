@@ -0,0 +1,70 @@
+"""
+HTTPアーカイブを使って1日分のスキャンをオフラインで再現する (ベンチマーク / 過去日の検証用)
+
+使い方:
+  # 1. 本番 (またはローカル) で記録
+  HTTP_ARCHIVE_MODE=record python main.py
+  # 2. ネットワークなしで再生
+  python replay_day.py 20260128 [--archive DIR] [--no-latency]
+
+開催情報の確認 → 全レースの取得 → 一括予測 → 記録 までを main と同じ関数で実行します。
+取得は1パスなので、各ページは本番がそのレースを予測した時点で最後に取ったレスポンスを再生します
+(展示タイム・オッズが本番の予測と同じになる)。
+履歴は一時DBに書くため race_data.db は変更しません。Discord への送信・Groq へのAI解説依頼はしません。
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+
+import http_archive
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("date", help="YYYYMMDD")
+    parser.add_argument("--archive", default=http_archive.ARCHIVE_DIR)
+    parser.add_argument("--no-latency", action="store_true", help="記録時の待ち時間を再現しない")
+    args = parser.parse_args()
+
+    http_archive.set_mode("replay", args.archive, latency=not args.no_latency, predicted=True)
+    # 外部サービスには一切つながない (解説はキーが無いときの定型文になり、一時DBが消えた後の追記も起きない)
+    os.environ.pop("DISCORD_WEBHOOK_URL", None)
+    os.environ.pop("GROQ_API_KEY", None)
+
+    import main as bot
+    from scheduler import RaceScheduler
+    from scraper import close_async
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_FILE = os.path.join(tmp, "replay.db")
+        bot.LEGACY_STATUS_FILE = None  # 一時DBに本番の通知済みリストを持ち込まない
+        bot.init_db()
+        bot.start_warmup()
+        bot.wait_models()
+        bot.load_notified(args.date)
+
+        t0 = time.perf_counter()
+        scheduler = RaceScheduler()
+        day_start = datetime.datetime.strptime(args.date, "%Y%m%d").replace(tzinfo=bot.JST)
+        bot.load_schedule(scheduler, args.date, now=day_start)
+        t_discover = time.perf_counter() - t0
+
+        # 過去日なので全レースが「締切直前」扱いになり、取得できたものは全て予測に回る
+        targets = scheduler.races()
+        t1 = time.perf_counter()
+        bot.scan_cycle(targets, args.date, scheduler)
+        t_scan = time.perf_counter() - t1
+
+        conn = sqlite3.connect(bot.DB_FILE)
+        picks = conn.execute("SELECT COUNT(*) FROM history WHERE date=?", (args.date,)).fetchone()[0]
+        conn.close()
+        close_async()
+
+    print("=" * 50)
+    print(f"📼 リプレイ {args.date}: {len(targets)}レース / 推奨 {picks}件")
+    print(f"   開催確認: {t_discover:.2f}秒 / スキャン: {t_scan:.2f}秒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import datetime
+import heapq
+
+# ==========================================
+# ⚙️ スケジューラ設定
+# ==========================================
+FETCH_WINDOW_MIN = 10   # 締切の何分前から取得を始めるか (展示タイムが出揃う頃)
+RETRY_SEC = 60          # 展示データ未確定・取得失敗時の再取得間隔
+LAST_CHANCE_SEC = 90    # 締切までこれ未満なら展示未確定でも予測に回す
+
+def parse_deadline(today, hhmm, tz):
+    """'YYYYMMDD' と 'HH:MM' から締切の datetime を作る。不正なら None"""
+    try:
+        if not hhmm or hhmm == "00:00": return None
+        d = datetime.datetime.strptime(f"{today} {hhmm}", "%Y%m%d %H:%M")
+        return d.replace(tzinfo=tz)
+    except: return None
+
+def exhibition_ready(raw):
+    """直前情報 (展示タイム) が1艇でも出ていれば確定とみなす"""
+    return any((raw.get(f'ex{i}') or 0) > 0 for i in range(1, 7))
+
+class RaceScheduler:
+    """締切時刻順の優先度付きキュー。各レースは締切前の取得窓でだけ取り出される"""
+
+    def __init__(self, window_min=FETCH_WINDOW_MIN, retry_sec=RETRY_SEC):
+        self.window = datetime.timedelta(minutes=window_min)
+        self.retry = datetime.timedelta(seconds=retry_sec)
+        self._heap = []         # (取得予定時刻, jcd, rno)
+        self._deadlines = {}    # (jcd, rno) -> 締切 datetime
+        self._finished = set()  # 予測済み or 締切超過 (二度とキューに戻さない)
+
+    def add(self, jcd, rno, deadline):
+        key = (jcd, rno)
+        if key in self._finished or deadline is None: return
+        known = key in self._deadlines
+        self._deadlines[key] = deadline
+        if not known:
+            heapq.heappush(self._heap, (deadline - self.window, jcd, rno))
+
+    def update_deadline(self, jcd, rno, deadline):
+        """取得ページで締切が変わっていた場合 (遅延など) に反映する"""
+        if deadline is not None and (jcd, rno) in self._deadlines:
+            self._deadlines[(jcd, rno)] = deadline
+
+    def races(self):
+        """登録済みの全レースを締切順に返す"""
+        return sorted(self._deadlines, key=lambda k: self._deadlines[k])
+
+    def deadline(self, jcd, rno):
+        return self._deadlines.get((jcd, rno))
+
+    def due(self, now):
+        """取得時刻を迎えたレースを取り出す。締切を過ぎたものは捨てる"""
+        targets = []
+        while self._heap and self._heap[0][0] <= now:
+            fetch_at, jcd, rno = heapq.heappop(self._heap)
+            key = (jcd, rno)
+            if key in self._finished: continue
+            deadline = self._deadlines.get(key)
+            if deadline is None or now >= deadline:
+                self._finished.add(key)
+                continue
+            # 締切が後ろにずれていたら取得窓に入るまで待つ
+            if deadline - self.window > fetch_at and deadline - self.window > now:
+                heapq.heappush(self._heap, (deadline - self.window, jcd, rno))
+                continue
+            targets.append(key)
+        # 締切が近い順
+        targets.sort(key=lambda k: self._deadlines[k])
+        return targets
+
+    def is_last_chance(self, jcd, rno, now):
+        deadline = self._deadlines.get((jcd, rno))
+        return deadline is None or (deadline - now).total_seconds() < LAST_CHANCE_SEC
+
+    def complete(self, jcd, rno):
+        self._finished.add((jcd, rno))
+
+    def reschedule(self, jcd, rno, now):
+        """再取得を予約。次の取得が締切に間に合わなければ終了扱い"""
+        key = (jcd, rno)
+        deadline = self._deadlines.get(key)
+        if deadline is None or now + self.retry >= deadline:
+            self._finished.add(key)
+            return
+        heapq.heappush(self._heap, (now + self.retry, jcd, rno))
+
+    def next_wakeup(self):
+        while self._heap and (self._heap[0][1], self._heap[0][2]) in self._finished:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pending_count(self):
+        return len(self._deadlines) - len(self._finished)
+
+    def snapshot(self):
+        """再起動後に restore できる状態 (pickle 可能な dict)"""
+        return {'window': self.window, 'retry': self.retry, 'heap': list(self._heap),
+                'deadlines': dict(self._deadlines), 'finished': set(self._finished)}
+
+    @classmethod
+    def restore(cls, state):
+        sched = cls()
+        sched.window, sched.retry = state['window'], state['retry']
+        sched._heap = list(state['heap'])
+        heapq.heapify(sched._heap)
+        sched._deadlines = dict(state['deadlines'])
+        sched._finished = set(state['finished'])
+        # サイクル中に保存された場合、due() で取り出したまま完了・再予約していないレースはキューに無い
+        # → 取得窓の先頭から入れ直す (窓を過ぎていれば次の due() ですぐ取り出される)
+        queued = {(jcd, rno) for _, jcd, rno in sched._heap}
+        for key, deadline in sched._deadlines.items():
+            if key not in queued and key not in sched._finished:
+                heapq.heappush(sched._heap, (deadline - sched.window, *key))
+        return sched
@@ -1,11 +1,72 @@
 from curl_cffi import requests
 from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from lxml import etree
+import lxml.html
+import numpy as np
+import asyncio
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
 import re
+import threading
+import time
 import unicodedata
 import warnings
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+import http_archive
+import metrics
+from harville import EXACTA_COMBOS, TRIFECTA_COMBOS
 
 warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
+BASE_URL = "https://www.boatrace.jp/owpc/pc/race"
+
+# HTMLパーサ: "lxml" (XPath一括抽出・高速) / "bs4" (従来の BeautifulSoup 実装)
+PARSER_BACKEND = os.environ.get("SCRAPER_PARSER", "lxml")
+
+# ==========================================
+# ⚙️ 非同期スクレイピング設定
+# ==========================================
+HOST_CONCURRENCY = 8    # boatrace.jp への同時リクエスト上限 (AIMD で 1〜この値の間を動く)
+ASYNC_MAX_CLIENTS = 16  # 接続プールのサイズ
+
+# ==========================================
+# ⚙️ ブロック検知・流量制御 (ホスト単位)
+# ==========================================
+BLOCK_MIN_BYTES = 5000          # 200 でもこれより小さいページはブロック画面とみなす
+BLOCK_STATUS = (403, 429, 503)
+HOST_MIN_CONCURRENCY = 1
+AIMD_DECREASE = 0.5             # ブロック・遅延時は同時数を半分に (成功1回ごとに +1/同時数)
+DECREASE_COOLDOWN_SEC = 2.0     # 同時に返ってきた失敗で何段も下げない
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_SLOW_SEC = 3.0          # 平均応答がこれを超えたら混雑とみなして下げる
+BLOCK_WINDOW = 20               # ブロック率を見る直近の応答数
+CIRCUIT_MIN_SAMPLES = 5
+CIRCUIT_BLOCK_RATE = 0.5        # 直近のブロック率がこれ以上でサーキットを開く (一定時間リクエストしない)
+CIRCUIT_BASE_SEC = 30           # 開くたびに倍 (上限 CIRCUIT_MAX_SEC)、±CIRCUIT_JITTER の揺らぎ
+CIRCUIT_MAX_SEC = 600
+CIRCUIT_JITTER = 0.5
+
+# ==========================================
+# ⚙️ レスポンスキャッシュ設定 (ページ種別ごとの有効秒数)
+# ==========================================
+PAGE_TTL = {
+    'racelist': 3 * 3600,       # 出走表: 当日中はほぼ不変
+    'beforeinfo': 30,           # 直前情報: 展示後に変わる (再取得間隔より短くする)
+    'raceresult': 7 * 24 * 3600, # 結果: 掲載後は不変 (着順・払戻が揃っていないページは scrape_result が捨てる)
+    'index': 1800,
+}
+DEFAULT_TTL = 60
+CACHE_MAX_ENTRIES = 600     # メモリ上に保持するページ数 (LRU)
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", "")  # 指定時はディスクにも保存して再起動後も再利用
+DISK_CACHE_MAX_AGE = 2 * 24 * 3600
+
 def clean_text(text):
     if not text: return ""
     text = unicodedata.normalize('NFKC', str(text))
@@ -15,27 +76,386 @@ def get_session():
     # Chrome 120 偽装 (ブロック回避)
     return requests.Session(impersonate="chrome120")
 
+_LXML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+
+def parse_html(content, backend=None):
+    """ページ本体をパースする。戻り値は lxml の要素 or BeautifulSoup (PARSER_BACKEND 次第)"""
+    if (backend or PARSER_BACKEND) == "bs4":
+        return BeautifulSoup(content, 'lxml')
+    return lxml.html.document_fromstring(content, parser=_LXML_PARSER)
+
+def _to_soup(res, ptype="other"):
+    if res.status_code != 200: return None
+    if len(res.content) < BLOCK_MIN_BYTES: # Block check
+        metrics.inc('blocked_responses', page=ptype)
+        return None
+    if "データがありません" in res.text:
+        metrics.inc('empty_pages', page=ptype)
+        return None
+    with metrics.timer('parse', page=ptype):
+        return parse_html(res.content)
+
+# ==========================================
+# 🗃️ レスポンスキャッシュ (URL単位 / LRU / ETag・Last-Modified 再検証)
+# ==========================================
+_cache_lock = threading.Lock()
+_cache = OrderedDict()  # url -> {'soup', 'content', 'etag', 'last_modified', 'fetched_at'}
+_disk_state = {'pruned': False}
+
+def page_type(url):
+    return urlsplit(url).path.rsplit('/', 1)[-1]
+
+def _disk_path(url):
+    return os.path.join(HTTP_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest())
+
+def _disk_prune():
+    if _disk_state['pruned']: return
+    _disk_state['pruned'] = True
+    try:
+        os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+        limit = time.time() - DISK_CACHE_MAX_AGE
+        for name in os.listdir(HTTP_CACHE_DIR):
+            path = os.path.join(HTTP_CACHE_DIR, name)
+            if os.path.getmtime(path) < limit: os.remove(path)
+    except: pass
+
+def _disk_load(url):
+    _disk_prune()
+    try:
+        base = _disk_path(url)
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        with gzip.open(base + ".gz", "rb") as f:
+            meta['content'] = f.read()
+        meta['soup'] = None
+        return meta
+    except: return None
+
+def _disk_save(url, entry):
+    _disk_prune()
+    try:
+        base = _disk_path(url)
+        if entry.get('content') is not None:
+            with gzip.open(base + ".gz.tmp", "wb") as f:
+                f.write(entry['content'])
+            os.replace(base + ".gz.tmp", base + ".gz")
+        meta = {k: entry.get(k) for k in ('etag', 'last_modified', 'fetched_at')}
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(base + ".json.tmp", base + ".json")
+    except: pass
+
+def _cache_get(url):
+    with _cache_lock:
+        entry = _cache.get(url)
+        if entry is not None:
+            _cache.move_to_end(url)
+            return entry
+    if not HTTP_CACHE_DIR: return None
+    entry = _disk_load(url)
+    if entry is not None: _cache_put(url, entry)
+    return entry
+
+def _cache_put(url, entry):
+    with _cache_lock:
+        _cache[url] = entry
+        _cache.move_to_end(url)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+def _cache_drop(url):
+    """メモリ・ディスク両方から消す (次回は必ず取り直す)"""
+    with _cache_lock:
+        _cache.pop(url, None)
+    if not HTTP_CACHE_DIR: return
+    base = _disk_path(url)
+    for path in (base + ".json", base + ".gz"):
+        try: os.remove(path)
+        except: pass
+
+def _is_fresh(url, entry):
+    return time.time() - entry['fetched_at'] < PAGE_TTL.get(page_type(url), DEFAULT_TTL)
+
+def _soup_of(entry):
+    # ディスクから戻したエントリは初回参照時にパース
+    if entry.get('soup') is None:
+        entry['soup'] = parse_html(entry['content'])
+    return entry['soup']
+
+def _conditional_headers(entry):
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'): headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'): headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def _handle_response(url, res, entry):
+    ptype = page_type(url)
+    if res.status_code == 304 and entry is not None:
+        metrics.inc('not_modified', page=ptype)
+        entry['fetched_at'] = time.time()
+        if HTTP_CACHE_DIR: _disk_save(url, {**entry, 'content': None})
+        return _soup_of(entry)
+
+    soup = _to_soup(res, ptype)
+    if soup is not None:
+        new = {
+            'soup': soup,
+            'content': res.content,
+            'etag': res.headers.get('ETag'),
+            'last_modified': res.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        _cache_put(url, new)
+        if HTTP_CACHE_DIR: _disk_save(url, new)
+    return soup
+
+# ==========================================
+# 🚦 ホストごとの流量制御 (AIMD 同時実行数 + サーキットブレーカー)
+# ==========================================
+class CircuitOpen(Exception):
+    """ブロック多発でホストへのリクエストを止めている間に投げる"""
+
+class HostController:
+    """1ホスト分の同時実行数・ブロック率・応答時間とサーキットの状態
+
+    同時数は成功で少しずつ上げ、ブロック・エラー・遅延で半分にする (AIMD)。
+    直近のブロック率が CIRCUIT_BLOCK_RATE を超えたら、揺らぎ付きの待ち時間だけ全リクエストを断る。
+    明けたら同時数1で試し (half-open)、通れば閉じて、ブロックならより長く開き直す。
+    統計・同時数上限は _lock で守る。待ち行列 (_waiters / active) は非同期ループのスレッドだけが触る。
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self._lock = threading.Lock()
+        self.limit = float(HOST_CONCURRENCY)
+        self.latency = None             # 応答時間の指数移動平均 (秒)
+        self._recent = deque(maxlen=BLOCK_WINDOW)
+        self._decreased_at = 0.0
+        self.open_until = 0.0
+        self.half_open = False
+        self.opens = 0                  # 連続して開いた回数 (待ち時間の指数)
+        self.active = 0
+        self._waiters = []              # (優先度, 連番, future) 小さいほど先
+        self._seq = itertools.count()
+        self.stats = {'ok': 0, 'blocked': 0, 'error': 0, 'rejected': 0, 'circuit_opens': 0}
+
+    def _is_open(self, now):
+        if self.open_until and now >= self.open_until:
+            self.open_until, self.half_open, self.limit = 0.0, True, float(HOST_MIN_CONCURRENCY)
+            print(f"🔌 {self.host}: 待機明け、同時1本で再開", flush=True)
+        return self.open_until > now
+
+    def is_open(self):
+        with self._lock:
+            return self._is_open(time.time())
+
+    def check(self):
+        with self._lock:
+            if not self._is_open(time.time()): return
+            self.stats['rejected'] += 1
+        metrics.inc('circuit_rejected', host=self.host)
+        raise CircuitOpen(self.host)
+
+    def _open(self, now):
+        backoff = min(CIRCUIT_MAX_SEC, CIRCUIT_BASE_SEC * 2 ** self.opens) * random.uniform(1 - CIRCUIT_JITTER, 1 + CIRCUIT_JITTER)
+        self.opens += 1
+        self.open_until, self.half_open = now + backoff, False
+        self.limit = float(HOST_MIN_CONCURRENCY)
+        self._recent.clear()
+        self.stats['circuit_opens'] += 1
+        metrics.inc('circuit_opens', host=self.host)
+        print(f"🚧 {self.host}: ブロック多発のため {backoff:.0f}秒 リクエスト停止", flush=True)
+
+    def record(self, outcome, seconds=None):
+        """応答1件の結果 ('ok' / 'blocked' / 'error') を反映する"""
+        now = time.time()
+        bad = outcome != 'ok'
+        with self._lock:
+            self.stats[outcome] += 1
+            if seconds is not None:
+                self.latency = seconds if self.latency is None else self.latency + LATENCY_EWMA_ALPHA * (seconds - self.latency)
+            self._recent.append(bad)
+            if self.open_until: return  # 開く前に出ていたリクエストの結果
+            if self.half_open:
+                if bad:
+                    self._open(now)
+                else:
+                    self.half_open, self.opens = False, 0
+                    print(f"✅ {self.host}: 取得再開", flush=True)
+                return
+
+            if bad or (self.latency or 0) > LATENCY_SLOW_SEC:
+                if now - self._decreased_at >= DECREASE_COOLDOWN_SEC:
+                    self.limit = max(float(HOST_MIN_CONCURRENCY), self.limit * AIMD_DECREASE)
+                    self._decreased_at = now
+            else:
+                self.limit = min(float(HOST_CONCURRENCY), self.limit + 1 / self.limit)
+
+            if len(self._recent) >= CIRCUIT_MIN_SAMPLES and sum(self._recent) / len(self._recent) >= CIRCUIT_BLOCK_RATE:
+                self._open(now)
+
+    async def acquire(self, priority=0):
+        """空きが無ければ priority の小さい順 (= 締切が近い順) に待つ"""
+        self.check()
+        if not self._waiters and self.active < int(self.limit):
+            self.active += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        metrics.inc('host_queued', host=self.host)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None: self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        if self.is_open():
+            # 止めている間は待っている分もまとめて断る (スケジューラが後で取り直す)
+            rejected = 0
+            while self._waiters:
+                fut = heapq.heappop(self._waiters)[2]
+                if not fut.done():
+                    fut.set_exception(CircuitOpen(self.host))
+                    rejected += 1
+            if rejected:
+                with self._lock: self.stats['rejected'] += rejected
+                metrics.inc('circuit_rejected', rejected, host=self.host)
+            return
+        while self._waiters and self.active < int(self.limit):
+            fut = heapq.heappop(self._waiters)[2]
+            if fut.done(): continue
+            self.active += 1
+            fut.set_result(None)
+
+    def summary(self):
+        with self._lock:
+            n = len(self._recent)
+            return {'limit': round(self.limit, 2), 'active': self.active, 'queued': len(self._waiters),
+                    'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                    'block_rate': round(sum(self._recent) / n, 3) if n else 0.0,
+                    'open_sec': round(max(0.0, self.open_until - time.time()), 1), **self.stats}
+
+_hosts_lock = threading.Lock()
+_hosts = {}  # netloc -> HostController
+
+def host_controller(url):
+    host = urlsplit(url).netloc
+    with _hosts_lock:
+        ctl = _hosts.get(host)
+        if ctl is None: ctl = _hosts[host] = HostController(host)
+    return ctl
+
+def host_stats():
+    with _hosts_lock:
+        ctls = list(_hosts.values())
+    return {c.host: c.summary() for c in ctls}
+
+def _outcome(res):
+    if res.status_code in BLOCK_STATUS: return 'blocked'
+    if res.status_code == 200 and len(res.content) < BLOCK_MIN_BYTES: return 'blocked'
+    return 'ok'
+
+def _fetch(session, url, headers):
+    # 記録・再生モードの切り替えはここだけで行う
+    if http_archive.is_replaying():
+        return http_archive.replay(url)
+    # 同期経路 (結果確認・開催確認) はスレッド数が少ないので、サーキットと応答の記録だけ
+    ctl = host_controller(url)
+    ctl.check()
+    t0 = time.perf_counter()
+    try:
+        res = session.get(url, timeout=10, headers=headers)
+    except Exception:
+        ctl.record('error', time.perf_counter() - t0)
+        raise
+    ctl.record(_outcome(res), time.perf_counter() - t0)
+    metrics.observe('fetch', time.perf_counter() - t0, page=page_type(url))
+    if http_archive.is_recording():
+        http_archive.record(url, res, time.perf_counter() - t0)
+    return res
+
 def get_soup(session, url):
+    # 記録中はキャッシュを使わない (キャッシュで済んだページはアーカイブに残らず、再生時に欠ける)
+    entry = None if http_archive.is_recording() else _cache_get(url)
+    if entry is not None and _is_fresh(url, entry):
+        metrics.inc('cache_hits', page=page_type(url))
+        return _soup_of(entry)
     try:
-        res = session.get(url, timeout=10)
-        if res.status_code != 200: return None
-        if len(res.content) < 5000: return None # Block check
-        if "データがありません" in res.text: return None
-        return BeautifulSoup(res.content, 'lxml')
+        res = _fetch(session, url, _conditional_headers(entry))
+        return _handle_response(url, res, entry)
     except: return None
 
+def cache_stats():
+    with _cache_lock:
+        return {'entries': len(_cache)}
+
+def parse_deadlines(soup_list):
+    """出走表ページの「締切予定時刻」行から {rno: "HH:MM"} を作る (1ページで全レース分取れる)"""
+    if not isinstance(soup_list, BeautifulSoup):
+        return _parse_deadlines_lxml(soup_list)
+    deadlines = {}
+    try:
+        # 文字列ノードで探す (タグで探すと <html> 自体が先にヒットしてしまう)
+        node = soup_list.find(string=re.compile("締切"))
+        tr = node.find_parent("tr") if node else None
+        if tr:
+            cells = tr.find_all(['th','td'])
+            for r in range(1, 13):
+                if len(cells) > r:
+                    m = re.search(r"(\d{2}:\d{2})", clean_text(cells[r].text))
+                    if m: deadlines[r] = m.group(1)
+    except: pass
+    return deadlines
+
+def scrape_open_venues(session, date_str):
+    """開催一覧ページから当日開催している会場コードのリストを返す。取得失敗時は None
+    競艇は毎日どこかで開催しているので、会場リンクが1つも無いページ (メンテナンス・レイアウト変更) も失敗扱い"""
+    soup = get_soup(session, f"{BASE_URL}/index?hd={date_str}")
+    if soup is None: return None
+    if isinstance(soup, BeautifulSoup):
+        links = soup.select("a[href*='raceindex']")
+    else:
+        links = soup.xpath("//a[contains(@href, 'raceindex')]")
+    venues = set()
+    for a in links:
+        m = re.search(r"jcd=(\d{2})", a.get("href", ""))
+        if m: venues.add(int(m.group(1)))
+    return sorted(v for v in venues if 1 <= v <= 24) or None
+
+def scrape_deadlines(session, jcd, date_str):
+    """会場の全レースの締切時刻を出走表1ページから取得する。開催なしなら {}"""
+    soup_list = get_soup(session, f"{BASE_URL}/racelist?rno=1&jcd={jcd:02d}&hd={date_str}")
+    if soup_list is None: return {}
+    return parse_deadlines(soup_list)
+
+def race_urls(jcd, rno, date_str):
+    q = f"rno={rno}&jcd={jcd:02d}&hd={date_str}"
+    return (f"{BASE_URL}/beforeinfo?{q}", f"{BASE_URL}/racelist?{q}", f"{BASE_URL}/raceresult?{q}")
+
 def scrape_race_data(session, jcd, rno, date_str):
-    base_url = "https://www.boatrace.jp/owpc/pc/race"
-    
     # 3ページ全てにアクセス
-    soup_before = get_soup(session, f"{base_url}/beforeinfo?rno={rno}&jcd={jcd:02d}&hd={date_str}")
-    soup_list = get_soup(session, f"{base_url}/racelist?rno={rno}&jcd={jcd:02d}&hd={date_str}")
-    soup_res = get_soup(session, f"{base_url}/raceresult?rno={rno}&jcd={jcd:02d}&hd={date_str}")
+    url_before, url_list, url_res = race_urls(jcd, rno, date_str)
+    soup_before = get_soup(session, url_before)
+    soup_list = get_soup(session, url_list)
+    soup_res = get_soup(session, url_res)
+    return parse_race_pages(jcd, rno, date_str, soup_before, soup_list, soup_res)
 
-    if not soup_before or not soup_list:
+def parse_race_pages(jcd, rno, date_str, soup_before, soup_list, soup_res):
+    if soup_before is None or soup_list is None:
         # 最低限、出走表がないと話にならない
         return None, "NO_DATA"
+    with metrics.timer('extract'):
+        if isinstance(soup_list, BeautifulSoup):
+            return _parse_race_pages_bs4(jcd, rno, date_str, soup_before, soup_list, soup_res)
+        return _parse_race_pages_lxml(jcd, rno, date_str, soup_before, soup_list, soup_res)
 
+def _new_row(jcd, rno, date_str):
     # --- 1. 全42項目の初期化 (指定された順序) ---
     row = {
         'date': int(date_str), 'jcd': jcd, 'rno': rno, 'wind': 0.0,
@@ -49,6 +469,55 @@ def scrape_race_data(session, jcd, rno, date_str):
         row[f'ex{i}'] = 0.0
         row[f'f{i}'] = 0
         row[f'st{i}'] = 0.20
+    return row
+
+def _fill_result_bs4(soup_res, row):
+    try:
+        # 順位 (rank1, rank2, rank3)
+        # is-w495 テーブルが着順表
+        ranks = soup_res.select("table.is-w495 tbody tr")
+        if len(ranks) >= 1:
+            r1 = clean_text(ranks[0].select("td")[1].text)
+            row['rank1'] = int(re.search(r"(\d)", r1).group(1))
+        if len(ranks) >= 2:
+            r2 = clean_text(ranks[1].select("td")[1].text)
+            row['rank2'] = int(re.search(r"(\d)", r2).group(1))
+        if len(ranks) >= 3:
+            r3 = clean_text(ranks[2].select("td")[1].text)
+            row['rank3'] = int(re.search(r"(\d)", r3).group(1))
+
+        # res1 (1号艇が1着かどうか)
+        if row['rank1'] == 1:
+            row['res1'] = 1
+        else:
+            row['res1'] = 0
+
+        # 払い戻し
+        for tbl in soup_res.select("table"):
+            txt = clean_text(tbl.text)
+            if "勝" in txt or "連" in txt:
+                for tr in tbl.select("tr"):
+                    tr_txt = clean_text(tr.text)
+
+                    pay = 0
+                    pay_node = tr.select_one(".is-payout1")
+                    if pay_node:
+                        p_txt = clean_text(pay_node.text).replace("¥","").replace(",","")
+                        if p_txt.isdigit(): pay = int(p_txt)
+
+                    if "3連単" in tr_txt:
+                        row['sanrentan'] = pay
+                        row['payout'] = pay # payoutは3連単配当を入れるのが一般的
+                    elif "3連複" in tr_txt:
+                        row['sanrenpuku'] = pay
+                    elif "2連単" in tr_txt:
+                        row['nirentan'] = pay
+                    elif "単勝" in tr_txt:
+                        row['tansho'] = pay
+    except: pass
+
+def _parse_race_pages_bs4(jcd, rno, date_str, soup_before, soup_list, soup_res):
+    row = _new_row(jcd, rno, date_str)
 
     # --- 2. 天候・風 (BeforeInfo) ---
     try:
@@ -114,66 +583,386 @@ def scrape_race_data(session, jcd, rno, date_str):
     # --- 4. レース結果 (RaceResult) ---
     # まだレースが終わっていない場合は、ここは初期値(None/0)のままになる
     if soup_res:
+        _fill_result_bs4(soup_res, row)
+
+    # --- 締切時刻 (スケジューラが使用) ---
+    row['deadline_time'] = parse_deadlines(soup_list).get(rno, "00:00")
+
+    return row, None
+
+# ==========================================
+# 🚀 lxml 抽出 (XPath を事前コンパイルし、1ページ1回の走査で全項目を拾う)
+# ==========================================
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+_X_BOAT_CELLS = etree.XPath(f"//*[{_has_class('is-boatColor1')} or {_has_class('is-boatColor2')} or {_has_class('is-boatColor3')} or {_has_class('is-boatColor4')} or {_has_class('is-boatColor5')} or {_has_class('is-boatColor6')}]")
+_X_WIND = etree.XPath(f"(//*[{_has_class('weather1_bodyUnitLabelData')}])[1]")
+_X_RANK_ROWS = etree.XPath(f"//table[{_has_class('is-w495')}]//tbody//tr")
+_X_TABLES = etree.XPath("//table")
+_X_TRS = etree.XPath(".//tr")
+_X_TDS = etree.XPath(".//td")
+_X_PAYOUT = etree.XPath(f"(.//*[{_has_class('is-payout1')}])[1]")
+_X_DEADLINE_TEXT = etree.XPath("(//text()[contains(., '締切')])[1]")
+_X_CELLS = etree.XPath(".//*[self::th or self::td]")
+
+def _boat_rows(doc):
+    """is-boatColor{i} の最初の要素が属する tr を艇番ごとに返す (1回の XPath 走査)"""
+    rows = {}
+    for el in _X_BOAT_CELLS(doc):
+        classes = (el.get("class") or "").split()
+        for i in range(1, 7):
+            if i not in rows and f"is-boatColor{i}" in classes:
+                rows[i] = next(el.iterancestors("tr"), None)
+    return rows
+
+def _parse_deadlines_lxml(doc):
+    deadlines = {}
+    try:
+        found = _X_DEADLINE_TEXT(doc)
+        if found:
+            node = found[0]
+            el = node.getparent()
+            if node.is_tail: el = el.getparent()
+            tr = el if el.tag == "tr" else next(el.iterancestors("tr"), None)
+            if tr is not None:
+                cells = _X_CELLS(tr)
+                for r in range(1, 13):
+                    if len(cells) > r:
+                        m = re.search(r"(\d{2}:\d{2})", clean_text(cells[r].text_content()))
+                        if m: deadlines[r] = m.group(1)
+    except: pass
+    return deadlines
+
+def _fill_result_lxml(doc_res, row):
+    try:
+        ranks = _X_RANK_ROWS(doc_res)
+        for k, key in enumerate(('rank1', 'rank2', 'rank3')):
+            if len(ranks) > k:
+                r_txt = clean_text(_X_TDS(ranks[k])[1].text_content())
+                row[key] = int(re.search(r"(\d)", r_txt).group(1))
+
+        row['res1'] = 1 if row['rank1'] == 1 else 0
+
+        # 払い戻し
+        for tbl in _X_TABLES(doc_res):
+            txt = clean_text(tbl.text_content())
+            if "勝" in txt or "連" in txt:
+                for tr in _X_TRS(tbl):
+                    tr_txt = clean_text(tr.text_content())
+
+                    pay = 0
+                    pay_node = _X_PAYOUT(tr)
+                    if pay_node:
+                        p_txt = clean_text(pay_node[0].text_content()).replace("¥","").replace(",","")
+                        if p_txt.isdigit(): pay = int(p_txt)
+
+                    if "3連単" in tr_txt:
+                        row['sanrentan'] = pay
+                        row['payout'] = pay
+                    elif "3連複" in tr_txt:
+                        row['sanrenpuku'] = pay
+                    elif "2連単" in tr_txt:
+                        row['nirentan'] = pay
+                    elif "単勝" in tr_txt:
+                        row['tansho'] = pay
+    except: pass
+
+def _parse_race_pages_lxml(jcd, rno, date_str, doc_before, doc_list, doc_res):
+    row = _new_row(jcd, rno, date_str)
+
+    # --- 2. 天候・風 (BeforeInfo) ---
+    try:
+        wind_txt = ""
+        w_node = _X_WIND(doc_before)
+        if w_node: wind_txt = w_node[0].text_content()
+        else:
+            m = re.search(r"風.*?(\d+)m", doc_before.text_content())
+            if m: wind_txt = m.group(1)
+
+        m = re.search(r"(\d+)", clean_text(wind_txt))
+        if m: row['wind'] = float(m.group(1))
+    except: pass
+
+    # --- 3. 各艇データ (BeforeInfo & RaceList) ---
+    before_rows = _boat_rows(doc_before)
+    list_rows = _boat_rows(doc_list)
+    for i in range(1, 7):
+        # 展示タイム (BeforeInfo)
         try:
-            # 順位 (rank1, rank2, rank3)
-            # is-w495 テーブルが着順表
-            ranks = soup_res.select("table.is-w495 tbody tr")
-            if len(ranks) >= 1:
-                r1 = clean_text(ranks[0].select("td")[1].text)
-                row['rank1'] = int(re.search(r"(\d)", r1).group(1))
-            if len(ranks) >= 2:
-                r2 = clean_text(ranks[1].select("td")[1].text)
-                row['rank2'] = int(re.search(r"(\d)", r2).group(1))
-            if len(ranks) >= 3:
-                r3 = clean_text(ranks[2].select("td")[1].text)
-                row['rank3'] = int(re.search(r"(\d)", r3).group(1))
-            
-            # res1 (1号艇が1着かどうか)
-            if row['rank1'] == 1:
-                row['res1'] = 1
-            else:
-                row['res1'] = 0
-
-            # 払い戻し
-            for tbl in soup_res.select("table"):
-                txt = clean_text(tbl.text)
-                if "勝" in txt or "連" in txt:
-                    for tr in tbl.select("tr"):
-                        tr_txt = clean_text(tr.text)
-                        
-                        pay = 0
-                        pay_node = tr.select_one(".is-payout1")
-                        if pay_node:
-                            p_txt = clean_text(pay_node.text).replace("¥","").replace(",","")
-                            if p_txt.isdigit(): pay = int(p_txt)
-
-                        if "3連単" in tr_txt:
-                            row['sanrentan'] = pay
-                            row['payout'] = pay # payoutは3連単配当を入れるのが一般的
-                        elif "3連複" in tr_txt:
-                            row['sanrenpuku'] = pay
-                        elif "2連単" in tr_txt:
-                            row['nirentan'] = pay
-                        elif "単勝" in tr_txt:
-                            row['tansho'] = pay
+            if i in before_rows:
+                tds = _X_TDS(before_rows[i])
+                if len(tds) > 4:
+                    val = clean_text(tds[4].text_content())
+                    if re.match(r"\d\.\d{2}", val): row[f'ex{i}'] = float(val)
+        except: pass
+
+        # 勝率・モーター・F・ST (RaceList)
+        try:
+            if i in list_rows:
+                tds = _X_TDS(list_rows[i])
+
+                # F数 / ST
+                if len(tds) > 3:
+                    txt = clean_text(tds[3].text_content())
+                    f_m = re.search(r"F(\d+)", txt)
+                    if f_m: row[f'f{i}'] = int(f_m.group(1))
+
+                    st_m = re.search(r"(\.\d{2}|\d\.\d{2})", txt)
+                    if st_m:
+                        v = float(st_m.group(1))
+                        if v < 1.0: row[f'st{i}'] = v
+
+                # 勝率
+                if len(tds) > 4:
+                    txt = clean_text(tds[4].text_content())
+                    wr_m = re.search(r"(\d\.\d{2})", txt)
+                    if wr_m: row[f'wr{i}'] = float(wr_m.group(1))
+
+                # モーター
+                if len(tds) > 6:
+                    txt = clean_text(tds[6].text_content())
+                    mo_m = re.findall(r"(\d{2,3}\.\d{2})", txt)
+                    if mo_m: row[f'mo{i}'] = float(mo_m[0])
         except: pass
 
-    # --- 締切時刻 (AI予測に必要なら残す、不要なら削除可) ---
-    row['deadline_time'] = "00:00"
+    # --- 4. レース結果 (RaceResult) ---
+    if doc_res is not None:
+        _fill_result_lxml(doc_res, row)
+
+    # --- 締切時刻 (スケジューラが使用) ---
+    row['deadline_time'] = _parse_deadlines_lxml(doc_list).get(rno, "00:00")
+
+    return row, None
+
+# ==========================================
+# ⚡ 非同期スクレイピング (共有セッション + 専用イベントループ)
+# ==========================================
+# AsyncSession はイベントループに紐づくため、常駐ループを1本立てて全スレッドから使い回す
+_async_lock = threading.Lock()
+_async_state = {'loop': None, 'session': None}
+
+def _ensure_async():
+    with _async_lock:
+        if _async_state['loop'] is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="scraper-loop", daemon=True).start()
+
+            async def setup():
+                _async_state['session'] = requests.AsyncSession(impersonate="chrome120", max_clients=ASYNC_MAX_CLIENTS)
+            asyncio.run_coroutine_threadsafe(setup(), loop).result()
+            _async_state['loop'] = loop
+    return _async_state['loop']
+
+async def _async_fetch(url, headers, priority=0):
+    if http_archive.is_replaying():
+        return await http_archive.async_replay(url)
+    ctl = host_controller(url)
+    await ctl.acquire(priority)
     try:
-        tgt = soup_list.find(lambda t: "締切" in t.text)
-        if tgt:
-            tr = tgt.find_parent("tr")
-            cells = tr.find_all(['th','td'])
-            if len(cells) > rno:
-                m = re.search(r"(\d{2}:\d{2})", clean_text(cells[rno].text))
-                if m: row['deadline_time'] = m.group(1)
+        t0 = time.perf_counter()
+        try:
+            res = await _async_state['session'].get(url, timeout=10, headers=headers)
+        except Exception:
+            ctl.record('error', time.perf_counter() - t0)
+            raise
+        ctl.record(_outcome(res), time.perf_counter() - t0)
+    finally:
+        ctl.release()
+    metrics.observe('fetch', time.perf_counter() - t0, page=page_type(url))
+    if http_archive.is_recording():
+        http_archive.record(url, res, time.perf_counter() - t0)
+    return res
+
+async def async_get_soup(url, priority=0):
+    # 記録中はキャッシュを使わない (キャッシュで済んだページはアーカイブに残らず、再生時に欠ける)
+    entry = None if http_archive.is_recording() else _cache_get(url)
+    if entry is not None and _is_fresh(url, entry):
+        metrics.inc('cache_hits', page=page_type(url))
+        return _soup_of(entry)
+    try:
+        res = await _async_fetch(url, _conditional_headers(entry), priority)
+        return _handle_response(url, res, entry)
+    except: return None
+
+async def async_scrape_race_data(jcd, rno, date_str, priority=0):
+    """scrape_race_data の非同期版。3ページを同時に取得し、同じ row dict を返す"""
+    soup_before, soup_list, soup_res = await asyncio.gather(*(async_get_soup(u, priority) for u in race_urls(jcd, rno, date_str)))
+    return parse_race_pages(jcd, rno, date_str, soup_before, soup_list, soup_res)
+
+async def _scrape_many(targets, date_str):
+    async def one(i, jcd, rno):
+        try: return await async_scrape_race_data(jcd, rno, date_str, priority=i)
+        except Exception as e: return None, f"ERROR: {e}"
+    return await asyncio.gather(*(one(i, jcd, rno) for i, (jcd, rno) in enumerate(targets)))
+
+def scrape_races(targets, date_str):
+    """[(jcd, rno), ...] をまとめて非同期取得し、targets と同じ順で (row, error) のリストを返す
+    同時数が絞られているときは targets の先頭 (scheduler.due の並び = 締切が近い順) から取りに行く"""
+    if not targets: return []
+    loop = _ensure_async()
+    return asyncio.run_coroutine_threadsafe(_scrape_many(targets, date_str), loop).result()
+
+def close_async():
+    loop = _async_state['loop']
+    if loop is None: return
+    async def teardown():
+        await _async_state['session'].close()
+    try: asyncio.run_coroutine_threadsafe(teardown(), loop).result(timeout=10)
     except: pass
+    loop.call_soon_threadsafe(loop.stop)
+    _async_state.update({'loop': None, 'session': None})
 
-    return row, None
+# ==========================================
+# 🏁 レース結果 (確定済みの結果はプロセス内で保持し、二度と取りに行かない)
+# ==========================================
+_result_lock = threading.Lock()
+_results = {}  # (date, jcd, rno) -> scrape_result の戻り値
+# 結果ページにこれがあれば、そのレースは払戻が出ない (中止・不成立。舟券は返還)
+VOID_MARKERS = ("レース中止", "不成立")
+
+def _page_text(soup):
+    return soup.get_text() if isinstance(soup, BeautifulSoup) else soup.text_content()
+
+def parse_result(soup_res):
+    """結果ページから着順と払戻 (100円あたり) を取り出す"""
+    row = {'res1': 0, 'rank1': None, 'rank2': None, 'rank3': None,
+           'tansho': 0, 'nirentan': 0, 'sanrentan': 0, 'sanrenpuku': 0, 'payout': 0}
+    if isinstance(soup_res, BeautifulSoup):
+        _fill_result_bs4(soup_res, row)
+    else:
+        _fill_result_lxml(soup_res, row)
+    return row
 
-# 互換性のためのダミー
 def scrape_result(session, jcd, rno, date_str):
+    """確定結果を返す。取得失敗 (タイムアウト・ブロック・サーキット遮断) なら None
+    {'sanrentan_combo': "1-2-3", 'sanrentan_payout': 100円あたり払戻, 'nirentan_combo': "1-2", 'nirentan_payout': ...}
+    中止・不成立のレースは {'void': True} (これも確定扱いで、二度と取りに行かない)
+    ページは取れたが着順・払戻が無ければ {'unsettled': True} (キャッシュせず、次回また取りに行く)"""
+    key = (str(date_str), int(jcd), int(rno))
+    # 記録中はチェックポイントから戻した結果も使わず、ページを取ってアーカイブに残す
+    if not http_archive.is_recording():
+        with _result_lock:
+            if key in _results: return _results[key]
+
+    url = race_urls(jcd, rno, date_str)[2]
+    soup_res = get_soup(session, url)
+    if soup_res is None: return None
+    row = parse_result(soup_res)
+    if not (row['rank1'] and row['rank2'] and row['rank3']) or not (row['sanrentan'] or row['nirentan']):
+        text = _page_text(soup_res)
+        if any(m in text for m in VOID_MARKERS):
+            res = {'void': True}
+            with _result_lock:
+                _results[key] = res
+            return res
+        # 着順・払戻が未掲載のページを結果の長い TTL で持ち続けない
+        _cache_drop(url)
+        return {'unsettled': True}
+
+    res = {
+        'rank1': row['rank1'], 'rank2': row['rank2'], 'rank3': row['rank3'],
+        'sanrentan_combo': f"{row['rank1']}-{row['rank2']}-{row['rank3']}",
+        'sanrentan_payout': row['sanrentan'],
+        'nirentan_combo': f"{row['rank1']}-{row['rank2']}",
+        'nirentan_payout': row['nirentan'],
+        'tansho_payout': row['tansho'],
+        'sanrenpuku_payout': row['sanrenpuku'],
+    }
+    with _result_lock:
+        _results[key] = res
+    return res
+
+def export_results(since_date=None):
+    """確定結果キャッシュのコピー (since_date 以降のみ)。チェックポイント用"""
+    with _result_lock:
+        return {k: v for k, v in _results.items() if since_date is None or k[0] >= str(since_date)}
+
+def import_results(results):
+    with _result_lock:
+        for k, v in results.items(): _results.setdefault(k, v)
+
+# ==========================================
+# 📈 オッズ (3連単 120通り / 2連単 30通りを固定インデックスの float32 配列で保持)
+# ==========================================
+# インデックスは買い目の辞書順 ("1-2-3", "1-2-4", ..., "6-5-4")。発売前・欠場は NaN
+TRIFECTA_INDEX = {c: i for i, c in enumerate(TRIFECTA_COMBOS)}
+EXACTA_INDEX = {c: i for i, c in enumerate(EXACTA_COMBOS)}
+ODDS_TTL = 20   # 同じレースのオッズはこの秒数だけ使い回す (締切直前は数十秒で動く)
+PAGE_TTL.update({'odds3t': ODDS_TTL, 'odds2tf': ODDS_TTL})
+
+# オッズ表は「1着艇ごとの列 × 2着・3着の行」。セルを文書順に読むと行優先 (行 r, 列 f) で並ぶので、
+# 1着 f+1 の r 番目の組 = 辞書順インデックス f * 行数 + r に並べ替える
+_TRIFECTA_ORDER = np.array([f * 20 + r for r in range(20) for f in range(6)])
+_EXACTA_ORDER = np.array([f * 5 + r for r in range(5) for f in range(6)])
+_X_ODDS_POINTS = etree.XPath(f"//td[{_has_class('oddsPoint')}]")
+
+_odds_lock = threading.Lock()
+_odds = {}  # (date, jcd, rno) -> スナップショット
+
+def odds_urls(jcd, rno, date_str):
+    """(3連単, 2連単・2連複) のオッズページ"""
+    q = f"rno={rno}&jcd={int(jcd):02d}&hd={date_str}"
+    return f"{BASE_URL}/odds3t?{q}", f"{BASE_URL}/odds2tf?{q}"
+
+def _odds_values(doc):
+    if doc is None: return []
+    cells = doc.select("td.oddsPoint") if isinstance(doc, BeautifulSoup) else _X_ODDS_POINTS(doc)
+    out = []
+    for td in cells:
+        try: out.append(float(clean_text(td.get_text() if isinstance(doc, BeautifulSoup) else td.text_content())))
+        except: out.append(np.nan)
+    return out
+
+def _odds_array(values, order):
+    arr = np.full(len(order), np.nan, dtype=np.float32)
+    if len(values) >= len(order):
+        arr[order] = np.asarray(values[:len(order)], dtype=np.float32)
+    return arr
+
+def parse_odds(doc_3t, doc_2tf):
+    """オッズページ2枚から (3連単 (120,), 2連単 (30,)) の float32 配列を返す
+    ※2連単ページの後半 (2連複) は読まない"""
+    return _odds_array(_odds_values(doc_3t), _TRIFECTA_ORDER), _odds_array(_odds_values(doc_2tf), _EXACTA_ORDER)
+
+def _odds_snapshot(jcd, rno, date_str, doc_3t, doc_2tf):
+    if doc_3t is None and doc_2tf is None: return None
+    trifecta, exacta = parse_odds(doc_3t, doc_2tf)
+    snap = {'date': str(date_str), 'jcd': int(jcd), 'rno': int(rno),
+            'trifecta': trifecta, 'exacta': exacta, 'fetched_at': time.time()}
+    with _odds_lock:
+        _odds[(snap['date'], snap['jcd'], snap['rno'])] = snap
+    return snap
+
+def _cached_odds(jcd, rno, date_str):
+    with _odds_lock:
+        snap = _odds.get((str(date_str), int(jcd), int(rno)))
+    if snap is not None and time.time() - snap['fetched_at'] < ODDS_TTL:
+        metrics.inc('cache_hits', page='odds')
+        return snap
     return None
-def scrape_odds(session, jcd, rno, date_str, target_boat=None, target_combo=None):
-    return {}
+
+def scrape_odds(session, jcd, rno, date_str):
+    """レースのオッズスナップショットを返す。取れなければ None
+    {'trifecta': float32[120], 'exacta': float32[30], 'fetched_at': epoch秒, 'date', 'jcd', 'rno'}
+    インデックスは TRIFECTA_COMBOS / EXACTA_COMBOS の順"""
+    snap = _cached_odds(jcd, rno, date_str)
+    if snap is not None: return snap
+    url_3t, url_2tf = odds_urls(jcd, rno, date_str)
+    return _odds_snapshot(jcd, rno, date_str, get_soup(session, url_3t), get_soup(session, url_2tf))
+
+async def async_scrape_odds(jcd, rno, date_str, priority=0):
+    snap = _cached_odds(jcd, rno, date_str)
+    if snap is not None: return snap
+    doc_3t, doc_2tf = await asyncio.gather(*(async_get_soup(u, priority) for u in odds_urls(jcd, rno, date_str)))
+    return _odds_snapshot(jcd, rno, date_str, doc_3t, doc_2tf)
+
+def scrape_odds_many(targets, date_str):
+    """[(jcd, rno), ...] のオッズをまとめて非同期取得し、targets と同じ順でスナップショット (or None) を返す"""
+    if not targets: return []
+    async def many():
+        async def one(i, jcd, rno):
+            try: return await async_scrape_odds(jcd, rno, date_str, priority=i)
+            except: return None
+        return await asyncio.gather(*(one(i, jcd, rno) for i, (jcd, rno) in enumerate(targets)))
+    return asyncio.run_coroutine_threadsafe(many(), _ensure_async()).result()
@@ -0,0 +1,266 @@
+"""
+本番用モデル (ultimate_boat_model.pkl) と戦略テーブル (ultimate_winning_strategies.csv) を作る
+
+使い方:
+  python train_model.py                      # race_data.db の race_features (結果確定分) で学習
+  python train_model.py --csv 過去データ.csv  # CSV から学習
+  python train_model.py --start 20250101 --rounds 2000
+
+1着/2着/3着の3モデルをプロセスプールで同時に学習し (各プロセスの LightGBM スレッド数は CPU数 / 3)、
+検証期間の予測から (券種, 買い目) ごとの収支・回収率を同じ実行の中で集計する。
+学習データは LightGBM の Dataset バイナリとして train_cache/ に保存し、同じデータなら再利用する。
+
+成果物はまず model_versions/<版>/ に書き、一時ファイル → os.replace で本番ファイルを置き換える
+(Bot 実行中に差し替えても、読み込み途中の壊れたファイルを掴むことはない)。
+"""
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import joblib
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+import feature_store
+import harville
+from predict_boat import BOAT_FEATS, MODEL_FILE, STRATEGY_FILE, TOP_COMBOS, build_feature_frame
+
+# ==========================================
+# ⚙️ 学習設定
+# ==========================================
+DB_FILE = "race_data.db"
+CACHE_DIR = "train_cache"          # Dataset バイナリの置き場
+VERSIONS_DIR = "model_versions"    # 版ごとの成果物
+KEEP_VERSIONS = 5                  # これより古い版は削除
+VALID_RATIO = 0.15                 # 学習期間の後 (日付順) をこの割合だけ early stopping の検証に使う
+HOLDOUT_RATIO = 0.15               # 末尾のこの割合は学習にも early stopping にも使わず、戦略集計だけに使う
+NUM_ROUNDS = 1000
+EARLY_STOPPING = 50
+TARGETS = ('r1', 'r2', 'r3')       # 1着 / 2着 / 3着 → rank1 / rank2 / rank3
+
+FEATURES = ['jcd', 'rno', 'wind']
+for _p in BOAT_FEATS:
+    FEATURES += [f'{_p}{i}' for i in range(1, 7)] + [f'{_p}{i}_rel' for i in range(1, 7)] + [f'{_p}_mean']
+
+PARAMS = {
+    'objective': 'multiclass',
+    'num_class': 6,
+    'learning_rate': 0.05,
+    'num_leaves': 63,
+    'min_data_in_leaf': 50,
+    'feature_fraction': 0.8,
+    'bagging_fraction': 0.8,
+    'bagging_freq': 1,
+    'max_bin': 255,
+    'seed': 42,
+    'verbose': -1,
+}
+
+def log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", flush=True)
+
+# ==========================================
+# 📂 データ読み込み
+# ==========================================
+RAW_COLS = ['date', 'jcd', 'rno', 'wind', 'rank1', 'rank2', 'rank3', 'nirentan', 'sanrentan']
+RAW_COLS += [f'{p}{i}' for p in BOAT_FEATS for i in range(1, 7)]
+
+def load_training_data(csv_path=None, start=None, end=None):
+    """結果確定済みのレースを日付順で返す (着順が 1〜6 で揃っている行だけ)"""
+    if csv_path:
+        header = pd.read_csv(csv_path, nrows=0).columns
+        df = pd.read_csv(csv_path, usecols=[c for c in RAW_COLS if c in header])
+        if 'date' in df:
+            if start: df = df[df['date'] >= int(start)]
+            if end: df = df[df['date'] <= int(end)]
+    else:
+        df = feature_store.load_features(DB_FILE, start, end, columns=[c for c in RAW_COLS if c in feature_store.NAMES], settled_only=True)
+
+    for c in ('rank1', 'rank2', 'rank3'):
+        if c not in df: raise ValueError(f"学習データに {c} 列がありません")
+        df[c] = pd.to_numeric(df[c], errors='coerce')
+    ok = df[['rank1', 'rank2', 'rank3']].isin(range(1, 7)).all(axis=1)
+    df = df[ok]
+    if 'date' in df:
+        df = df.sort_values(['date', 'jcd', 'rno'], kind='stable')
+    return df.reset_index(drop=True)
+
+# ==========================================
+# 💾 Dataset バイナリキャッシュ
+# ==========================================
+def _data_key(X, labels):
+    h = hashlib.sha256()
+    h.update(json.dumps([FEATURES, PARAMS['max_bin'], VALID_RATIO, HOLDOUT_RATIO]).encode())
+    h.update(np.ascontiguousarray(X).tobytes())
+    for y in labels: h.update(np.ascontiguousarray(y).tobytes())
+    return h.hexdigest()[:16]
+
+def prepare_datasets(X, labels, split, holdout):
+    """ターゲットごとの学習 (X[:split]) / 検証 (X[split:holdout]) Dataset バイナリのパスを返す。同じデータなら既存のものを使う"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = _data_key(X, labels.values())
+    paths = {}
+    for target, y in labels.items():
+        train_bin = os.path.join(CACHE_DIR, f"{key}_{target}.train.bin")
+        valid_bin = os.path.join(CACHE_DIR, f"{key}_{target}.valid.bin")
+        if os.path.exists(train_bin) and os.path.exists(valid_bin):
+            log(f"⚡ Datasetキャッシュ再利用: {target} ({key})")
+        else:
+            ds_params = {'max_bin': PARAMS['max_bin'], 'verbose': -1}
+            train = lgb.Dataset(X[:split], label=y[:split], feature_name=FEATURES, params=ds_params, free_raw_data=False)
+            valid = lgb.Dataset(X[split:holdout], label=y[split:holdout], reference=train, params=ds_params)
+            _save_binary(train, train_bin)
+            _save_binary(valid, valid_bin)
+            log(f"💾 Datasetキャッシュ作成: {target} ({key})")
+        paths[target] = (train_bin, valid_bin)
+    return paths
+
+def _save_binary(ds, path):
+    tmp = path + ".tmp"
+    if os.path.exists(tmp): os.remove(tmp)
+    ds.save_binary(tmp)
+    os.replace(tmp, path)
+
+# ==========================================
+# 🧠 学習 (ターゲットごとに別プロセス)
+# ==========================================
+def _train_job(target, train_bin, valid_bin, params, num_rounds):
+    t0 = time.perf_counter()
+    train = lgb.Dataset(train_bin, params={'verbose': -1})
+    valid = lgb.Dataset(valid_bin, reference=train, params={'verbose': -1})
+    booster = lgb.train(params, train, num_boost_round=num_rounds, valid_sets=[valid],
+                        callbacks=[lgb.early_stopping(EARLY_STOPPING, verbose=False)])
+    return target, booster, booster.best_iteration, time.perf_counter() - t0
+
+def train_all(paths, num_rounds, workers=None):
+    workers = workers or len(paths)
+    params = dict(PARAMS, num_threads=max(1, (os.cpu_count() or 1) // workers))
+    log(f"🧠 学習開始: {len(paths)}モデル / {workers}プロセス × {params['num_threads']}スレッド")
+
+    jobs = [(t, tr, va, params, num_rounds) for t, (tr, va) in paths.items()]
+    if workers <= 1:
+        done = [_train_job(*j) for j in jobs]
+    else:
+        # LightGBM (OpenMP) を読み込んだ親を fork すると固まることがあるので spawn
+        ctx = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+            done = list(ex.map(_train_job, *zip(*jobs)))
+
+    models = {}
+    for target, booster, best_iter, sec in done:
+        log(f"✅ {target}: {best_iter}ラウンド / {sec:.1f}秒")
+        models[target] = booster
+    return models
+
+# ==========================================
+# 📋 戦略テーブル (ホールドアウト期間の成績)
+# ==========================================
+def strategy_table(models, X_valid, valid_df):
+    """ホールドアウト期間に Bot が候補にする買い目 (harville の確率上位 TOP_COMBOS 点) ごとに
+    購入数・的中率・収支・回収率を集計 (predict_boat の読み込み形式)。
+    本番は候補をこの表で絞ってから期待値で選ぶので、候補になり得る買い目は全て1点買いとして数える。
+    early stopping に使った期間で集計すると成績が甘くなるので分ける"""
+    P = [models[t].predict(X_valid, num_iteration=models[t].best_iteration) for t in TARGETS]
+    r = [valid_df[c].to_numpy(dtype=int).astype(str) for c in ('rank1', 'rank2', 'rank3')]
+    actual = {'3連単': np.char.add(np.char.add(np.char.add(np.char.add(r[0], "-"), r[1]), "-"), r[2]),
+              '2連単': np.char.add(np.char.add(r[0], "-"), r[1])}
+    tri, exa = harville.combo_probs(*P)
+    picks = {'3連単': (tri, harville.TRIFECTA_COMBOS, 'sanrentan'),
+             '2連単': (exa, harville.EXACTA_COMBOS, 'nirentan')}
+
+    frames = []
+    for ptype, (probs, combos, pay_col) in picks.items():
+        # predict_boat._select と同じ順位付け (同確率は並び順が先の買い目が上位)
+        k = min(TOP_COMBOS, probs.shape[1])
+        top = np.argsort(-probs, axis=1, kind='stable')[:, :k]
+        combo = np.asarray(combos)[top].ravel()
+        hit = combo == np.repeat(actual[ptype], k)
+        payout = pd.to_numeric(valid_df[pay_col], errors='coerce').fillna(0).to_numpy() if pay_col in valid_df else np.zeros(len(valid_df))
+        payout = np.repeat(payout, k)
+        g = pd.DataFrame({'買い目': combo, 'hit': hit, 'ret': np.where(hit, payout, 0.0)}).groupby('買い目')
+        t = pd.DataFrame({'購入数': g.size(), '的中数': g['hit'].sum(), '払戻': g['ret'].sum()}).reset_index()
+        t.insert(0, '券種', ptype)
+        frames.append(t)
+
+    table = pd.concat(frames, ignore_index=True)
+    table['収支'] = (table['払戻'] - table['購入数'] * 100).astype(int)
+    table['的中率'] = (table['的中数'] / table['購入数'] * 100).round(1)
+    table['回収率'] = (table['払戻'] / (table['購入数'] * 100) * 100).round(1)
+    table = table.sort_values('収支', ascending=False).reset_index(drop=True)
+    return table[['券種', '買い目', '収支', '的中率', '回収率', '購入数', '的中数']]
+
+# ==========================================
+# 📦 成果物の書き出し (版管理 + アトミック置き換え)
+# ==========================================
+def _atomic_copy(src, dst):
+    tmp = dst + ".tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def publish(models, table, meta):
+    version = meta['version']
+    vdir = os.path.join(VERSIONS_DIR, version)
+    os.makedirs(vdir, exist_ok=True)
+
+    bundle = {'features': FEATURES, 'version': version}
+    bundle.update(models)
+    joblib.dump(bundle, os.path.join(vdir, MODEL_FILE))
+    table.to_csv(os.path.join(vdir, STRATEGY_FILE), index=False, encoding='utf-8-sig')
+    with open(os.path.join(vdir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # 戦略テーブル → モデル の順で差し替え (モデルの更新検知が新しい表と揃うように)
+    _atomic_copy(os.path.join(vdir, STRATEGY_FILE), STRATEGY_FILE)
+    _atomic_copy(os.path.join(vdir, MODEL_FILE), MODEL_FILE)
+    log(f"📦 公開: {MODEL_FILE} / {STRATEGY_FILE} (版 {version})")
+
+    old = sorted(d for d in os.listdir(VERSIONS_DIR) if os.path.isdir(os.path.join(VERSIONS_DIR, d)))[:-KEEP_VERSIONS]
+    for d in old:
+        shutil.rmtree(os.path.join(VERSIONS_DIR, d), ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", help="学習CSV (省略時は race_data.db の race_features)")
+    parser.add_argument("--start", help="YYYYMMDD")
+    parser.add_argument("--end", help="YYYYMMDD")
+    parser.add_argument("--rounds", type=int, default=NUM_ROUNDS)
+    parser.add_argument("--workers", type=int, default=None, help="学習プロセス数 (既定: 3)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    df = load_training_data(args.csv, args.start, args.end)
+    holdout = int(len(df) * (1 - HOLDOUT_RATIO))
+    split = int(len(df) * (1 - HOLDOUT_RATIO - VALID_RATIO))
+    if split < 100 or holdout - split < 100 or len(df) - holdout < 100:
+        log(f"❌ 学習データが足りません ({len(df)}件)")
+        return
+    log(f"📂 {len(df):,}レース (学習 {split:,} / 検証 {holdout - split:,} / 戦略集計 {len(df) - holdout:,})")
+
+    X = build_feature_frame(df, FEATURES)
+    labels = {t: df[f'rank{k}'].to_numpy(dtype=np.int32) - 1 for k, t in enumerate(TARGETS, start=1)}
+    paths = prepare_datasets(X, labels, split, holdout)
+    models = train_all(paths, args.rounds, args.workers)
+
+    table = strategy_table(models, X[holdout:], df.iloc[holdout:])
+    log(f"📋 戦略テーブル: {len(table)}件 (収支プラス {int((table['収支'] > 0).sum())}件)")
+
+    meta = {
+        'version': datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+        'source': args.csv or DB_FILE,
+        'rows': len(df), 'train_rows': split, 'valid_rows': holdout - split, 'holdout_rows': len(df) - holdout,
+        'date_range': [int(df['date'].iloc[0]), int(df['date'].iloc[-1])] if 'date' in df else None,
+        'best_iteration': {t: int(m.best_iteration) for t, m in models.items()},
+        'params': PARAMS,
+    }
+    publish(models, table, meta)
+    log(f"🏁 完了: {time.perf_counter() - t0:.1f}秒")
+
+if __name__ == "__main__":
+    main()
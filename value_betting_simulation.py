@@ -3,12 +3,25 @@ import numpy as np
 import lightgbm as lgb
 import time
 import os
+import hashlib
+import json
+
+import backtest
 
 # ==========================================
 # ⚙️ 設定エリア
 # ==========================================
 CSV_PATH = r"C:\Users\TAKUMA\競艇に勝つ\競艇データ\FINAL_FULL_DATA_2025_FIXED.csv"
 EV_THRESHOLD = 1.2  # 期待値1.2以上を「買い」と判定
+CHUNK_ROWS = 200_000  # CSVをこの行数ずつ読み込む
+GRID_FOLDS = 5        # 閾値グリッドの walk-forward 分割数
+
+# 読み込む列と型 (必要な列だけを省メモリな型で読む)
+RAW_DTYPES = {'jcd': 'int8', 'rno': 'int8', 'wind': 'float32',
+              'rank1': 'float32', 'rank2': 'float32',   # 欠損があるので読み込み時は float → 除外後に int8
+              'tansho': 'float32', 'nirentan': 'float32'}
+for i in range(1, 7):
+    RAW_DTYPES.update({f'wr{i}': 'float32', f'st{i}': 'float32', f'ex{i}': 'float32'})
 
 def log(msg):
     print(f"[{time.strftime('%H:%M:%S')}] {msg}", flush=True)
@@ -19,14 +32,49 @@ def engineer_features(df):
         df[f'st_gap_{i}_{i+1}'] = df[f'st{i+1}'] - df[f'st{i}']
         df[f'wr_gap_{i}_{i+1}'] = df[f'wr{i}'] - df[f'wr{i+1}']
     avg_wr = df[[f'wr{i}' for i in range(1, 7)]].mean(axis=1)
-    df['wr_1_vs_avg'] = df['wr1'] / (avg_wr + 0.001)
+    df['wr_1_vs_avg'] = (df['wr1'] / (avg_wr + 0.001)).astype('float32')
     df['jcd'] = df['jcd'].astype('category')
     return df
 
-# 2. データ準備
-log("📂 データを読み込んでいます...")
-df = pd.read_csv(CSV_PATH).dropna(subset=['rank1', 'rank2', 'tansho', 'nirentan'])
-df = engineer_features(df)
+def _cache_path(csv_path, dtypes):
+    # CSVと同じフォルダに置く。読み込む列・型が変わったら別ファイルになる (古い型のキャッシュを掴まない)
+    key = hashlib.sha1(json.dumps(list(dtypes.items())).encode()).hexdigest()[:10]
+    return f"{os.path.splitext(csv_path)[0]}.{key}.cache"
+
+def load_data(csv_path):
+    """必要列だけを省メモリ型でチャンク読み込みし、バイナリキャッシュを作る (2回目以降は数秒)"""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    usecols = [c for c in RAW_DTYPES if c in header]
+    dtypes = {c: RAW_DTYPES[c] for c in usecols}
+    cache = _cache_path(csv_path, dtypes)
+    csv_mtime = os.path.getmtime(csv_path)
+    for ext, reader in ((".parquet", pd.read_parquet), (".pkl", pd.read_pickle)):
+        path = cache + ext
+        if os.path.exists(path) and os.path.getmtime(path) >= csv_mtime:
+            try:
+                df = reader(path)
+                log(f"⚡ キャッシュから読み込み: {path} ({len(df):,}行)")
+                return df
+            except Exception as e:
+                log(f"⚠️ キャッシュ読込失敗 ({e})。CSVから読み直します")
+
+    chunks = []
+    for chunk in pd.read_csv(csv_path, usecols=usecols, dtype=dtypes, chunksize=CHUNK_ROWS):
+        chunks.append(chunk.dropna(subset=['rank1', 'rank2', 'tansho', 'nirentan']))
+    df = pd.concat(chunks, ignore_index=True)
+    df['rank1'] = df['rank1'].astype('int8')
+    df['rank2'] = df['rank2'].astype('int8')
+    df['jcd'] = df['jcd'].astype('category')
+
+    # Parquet (pyarrow があれば) → なければ pickle
+    try:
+        df.to_parquet(cache + ".parquet")
+        log(f"💾 キャッシュ作成: {cache}.parquet")
+    except ImportError:
+        df.to_pickle(cache + ".pkl")
+        log(f"💾 キャッシュ作成: {cache}.pkl")
+    log(f"📦 {len(df):,}行 / {df.memory_usage(deep=True).sum() / 1024**2:.1f}MB")
+    return df
 
 features = ['jcd', 'rno', 'wind', 'wr_1_vs_avg']
 for i in range(1, 7):
@@ -34,26 +82,8 @@ for i in range(1, 7):
 for i in range(1, 6):
     features.extend([f'st_gap_{i}_{i+1}', f'wr_gap_{i}_{i+1}'])
 
-# 正解ラベル
-df['target_tan'] = df['rank1'].astype(int) - 1
 combinations = [f"{f}-{s}" for f in range(1, 7) for s in range(1, 7) if f != s]
 combo_to_id = {c: i for i, c in enumerate(combinations)}
-df['target_niren'] = (df['rank1'].astype(int).astype(str) + "-" + df['rank2'].astype(int).astype(str)).map(combo_to_id)
-df = df.dropna(subset=['target_niren'])
-
-# 分割
-split_idx = int(len(df) * 0.8)
-train_df, test_df = df.iloc[:split_idx], df.iloc[split_idx:]
-
-# 3. 学習（検証用にサクッと学習させます）
-log("🧠 AIの学習を実行中...")
-model_tan = lgb.train({'objective':'multiclass','num_class':6,'verbose':-1}, 
-                      lgb.Dataset(train_df[features], label=train_df['target_tan']), num_boost_round=100)
-model_niren = lgb.train({'objective':'multiclass','num_class':30,'verbose':-1}, 
-                        lgb.Dataset(train_df[features], label=train_df['target_niren']), num_boost_round=100)
-
-# 4. 期待値シミュレーション
-log("📊 期待値(EV)に基づいたシミュレーションを開始...")
 
 def run_ev_analysis(model, test_data, payout_col, target_col, name, prob_th):
     probs = model.predict(test_data[features])
@@ -83,5 +113,51 @@ def run_ev_analysis(model, test_data, payout_col, target_col, name, prob_th):
         rec = (d['Hit'] * d['Payout']).sum() / (len(d) * 100) * 100
         print(f"[{label}] 的中率: {acc:5.2f}% | 回収率: {rec:6.2f}% | 購入数: {len(d):5d}R | 平均オッズ: {d['Odds'].mean():4.2f}倍")
 
-run_ev_analysis(model_tan, test_df, 'tansho', 'target_tan', "単勝", 0.7)
-run_ev_analysis(model_niren, test_df, 'nirentan', 'target_niren', "二連単", 0.3)
\ No newline at end of file
+def run_grid_analysis(model, test_data, payout_col, target_col, name):
+    """確率閾値 × EV閾値 の全組み合わせを一括評価し、上位と walk-forward 成績を表示"""
+    probs = model.predict(test_data[features])
+    conf = np.max(probs, axis=1)
+    hit = np.argmax(probs, axis=1) == test_data[target_col].values
+    payout = test_data[payout_col].to_numpy(dtype=np.float64)
+
+    t0 = time.time()
+    ranking, wf = backtest.walk_forward(conf, payout / 100.0, hit, payout, n_folds=GRID_FOLDS)
+    print(f"\n--- 【{name}】 閾値グリッド ({time.time() - t0:.1f}秒) ---")
+    print(ranking.head(10).to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+    if not wf.empty:
+        print(f"[walk-forward] 平均回収率: {wf['roi'].mean():.2f}%")
+        print(wf.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+
+def main():
+    # 2. データ準備
+    log("📂 データを読み込んでいます...")
+    df = load_data(CSV_PATH)
+    df = engineer_features(df)
+
+    # 正解ラベル
+    df['target_tan'] = df['rank1'].astype(int) - 1
+    df['target_niren'] = (df['rank1'].astype(int).astype(str) + "-" + df['rank2'].astype(int).astype(str)).map(combo_to_id)
+    df = df.dropna(subset=['target_niren'])
+
+    # 分割
+    split_idx = int(len(df) * 0.8)
+    train_df, test_df = df.iloc[:split_idx], df.iloc[split_idx:]
+
+    # 3. 学習（検証用にサクッと学習させます）
+    log("🧠 AIの学習を実行中...")
+    model_tan = lgb.train({'objective':'multiclass','num_class':6,'verbose':-1}, 
+                          lgb.Dataset(train_df[features], label=train_df['target_tan']), num_boost_round=100)
+    model_niren = lgb.train({'objective':'multiclass','num_class':30,'verbose':-1}, 
+                            lgb.Dataset(train_df[features], label=train_df['target_niren']), num_boost_round=100)
+
+    # 4. 期待値シミュレーション
+    log("📊 期待値(EV)に基づいたシミュレーションを開始...")
+    run_ev_analysis(model_tan, test_df, 'tansho', 'target_tan', "単勝", 0.7)
+    run_ev_analysis(model_niren, test_df, 'nirentan', 'target_niren', "二連単", 0.3)
+
+    # 5. 閾値グリッド (MIN_PROFIT / EV_THRESHOLD の調整用)
+    run_grid_analysis(model_tan, test_df, 'tansho', 'target_tan', "単勝")
+    run_grid_analysis(model_niren, test_df, 'nirentan', 'target_niren', "二連単")
+
+if __name__ == "__main__":
+    main()